@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+
+"""Automatic offset and drift correction of subtitles from a different release or against the audio."""
+
+import os
+import subprocess
+
+from . import media
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+RESOLUTION = 0.05 # seconds per sample of the speech activity vectors
+MAX_OFFSET = 300 # seconds
+# releases for PAL (25 fps) and film (23.976 or 24 fps) run at different speeds
+FRAMERATE_RATIOS = [1.0, 25 / 23.976, 23.976 / 25, 25 / 24.0, 24 / 25.0, 24 / 23.976, 23.976 / 24]
+DRIFT_WINDOW = 300 # seconds of subtitles used for every local offset
+DRIFT_MAX_OFFSET = 10 # seconds around the global offset
+DRIFT_MIN_WINDOWS = 3
+DRIFT_MIN_SCORE = 20 # correlation a window needs to count, about the seconds of matching speech
+MIN_GAIN = 0.05 # the retimed subtitles must correlate this much better
+MIN_CORRELATION = 0.3 # and at least this much, subtitles of another movie correlate about 0.05
+
+ENVELOPE_SAMPLE_RATE = 8000 # speech energy is below 4 kHz
+ENVELOPE_CHUNK_FRAMES = 4096 # envelope frames reduced from every read of the ffmpeg output
+AUDIO_MAX_OFFSET = 60 # seconds, subtitles made for the video are off by seconds, not minutes
+AUDIO_MIN_CORRELATION = 0.1 # speech energy follows the subtitles much more loosely than other subtitles
+SNAP_WINDOW = 0.5 # seconds around a clip boundary searched for silence
+SILENCE_QUANTILE = 0.2 # frames quieter than this share of the audio count as silence
+
+def is_available():
+    return np is not None
+
+def activity(subs, origin, num_samples, resolution=RESOLUTION):
+    # 1 where a subtitle is on screen, 0 elsewhere, minus the mean so that only the
+    # pattern of speech and pauses correlates
+    changes = np.zeros(num_samples + 1, dtype=np.int32)
+    if len(subs) != 0:
+        times = np.array([(sub[0], sub[1]) for sub in subs], dtype=np.float64)
+        idx = np.clip(((times - origin) / resolution).astype(np.int64), 0, num_samples)
+        np.add.at(changes, idx[:, 0], 1)
+        np.add.at(changes, idx[:, 1], -1)
+    v = (np.cumsum(changes[:-1]) > 0).astype(np.float32)
+    return v - v.mean()
+
+def cross_correlation(a, b, max_lag):
+    # (lags, values) where values[i] = sum(a[t + lags[i]] * b[t])
+    size = 1 << (len(a) + len(b) - 1).bit_length()
+    corr = np.fft.irfft(np.fft.rfft(a, size) * np.conj(np.fft.rfft(b, size)), size)
+    lags = np.arange(-max_lag, max_lag + 1)
+    return lags, corr[lags % size]
+
+def find_offset(ref_subs, subs, max_offset=MAX_OFFSET, origin=0.0, length=None, resolution=RESOLUTION):
+    """Returns (offset, score): subs shifted by offset seconds correlate with ref_subs the most."""
+    if length is None:
+        length = max(max(sub[1] for sub in ref_subs), max(sub[1] for sub in subs)) - origin
+    num_samples = int(length / resolution) + 1
+
+    a = activity(ref_subs, origin, num_samples, resolution)
+    b = activity(subs, origin, num_samples, resolution)
+    lags, values = cross_correlation(a, b, min(int(max_offset / resolution), num_samples - 1))
+
+    best = np.argmax(values)
+    return lags[best] * resolution, values[best] * resolution
+
+def normalized_correlation(a, b):
+    norm = np.sqrt(np.dot(a, a) * np.dot(b, b))
+    if norm == 0:
+        return 0.0
+    return float(np.dot(a, b) / norm)
+
+def correlation(ref_subs, subs, resolution=RESOLUTION):
+    # from -1 to 1
+    length = max(max(sub[1] for sub in ref_subs), max(sub[1] for sub in subs))
+    num_samples = int(length / resolution) + 1
+    a = activity(ref_subs, 0.0, num_samples, resolution)
+    b = activity(subs, 0.0, num_samples, resolution)
+    return normalized_correlation(a, b)
+
+def retime(subs, scale, shift):
+    return [(max(0.0, sub[0] * scale + shift), max(0.0, sub[1] * scale + shift)) + tuple(sub[2:]) for sub in subs]
+
+def fit_alignment(subs, find_subs_offset, subs_correlation, max_offset, min_score, min_correlation):
+    """Returns (scale, shift) so that subs retimed to t * scale + shift match a reference,
+    (1.0, 0.0) if they can't be matched better.
+
+    find_subs_offset(subs, max_offset, origin, length) returns (offset, score) against the
+    reference, of the whole of it if length is None; subs_correlation(subs) compares them whole.
+    """
+    # global offset for every speed, subs are retimed to t * ratio + offset
+    ratio, offset, best_score = 1.0, 0.0, None
+    for r in FRAMERATE_RATIOS:
+        o, s = find_subs_offset(retime(subs, r, 0.0), max_offset, 0.0, None)
+        if best_score is None or s > best_score:
+            ratio, offset, best_score = r, o, s
+    shifted = retime(subs, ratio, offset)
+
+    # local offsets over windows of the shifted subtitles give the drift
+    centers = []
+    offsets = []
+    weights = []
+    start = min(sub[0] for sub in shifted)
+    end = max(sub[1] for sub in shifted)
+    while start < end:
+        window_subs = [sub for sub in shifted if start <= sub[0] < start + DRIFT_WINDOW]
+        if len(window_subs) != 0:
+            origin = start - DRIFT_MAX_OFFSET
+            local_offset, local_score = find_subs_offset(window_subs, DRIFT_MAX_OFFSET, origin, DRIFT_WINDOW + 2 * DRIFT_MAX_OFFSET)
+            if local_score >= min_score:
+                centers.append(start + DRIFT_WINDOW / 2.0)
+                offsets.append(local_offset)
+                weights.append(local_score)
+        start += DRIFT_WINDOW
+
+    scale, shift = ratio, offset
+    if len(centers) >= DRIFT_MIN_WINDOWS:
+        drift, local_shift = np.polyfit(centers, offsets, 1, w=weights)
+        scale = ratio * (1.0 + drift)
+        shift = offset * (1.0 + drift) + local_shift
+
+    old_correlation = subs_correlation(subs)
+    new_correlation = subs_correlation(retime(subs, scale, shift))
+    if new_correlation < min_correlation or new_correlation <= old_correlation * (1 + MIN_GAIN):
+        return 1.0, 0.0
+
+    return float(scale), float(shift)
+
+def find_alignment(ref_subs, subs):
+    """Returns (scale, shift) so that subs retimed to t * scale + shift match ref_subs,
+    (1.0, 0.0) if they can't be matched better or NumPy isn't installed."""
+    if np is None or len(ref_subs) == 0 or len(subs) == 0:
+        return 1.0, 0.0
+
+    def find_subs_offset(subs, max_offset, origin, length):
+        window_ref_subs = ref_subs
+        if length is not None:
+            window_ref_subs = [sub for sub in ref_subs if sub[1] > origin and sub[0] < origin + length]
+            if len(window_ref_subs) == 0:
+                return 0.0, 0.0
+        return find_offset(window_ref_subs, subs, max_offset, origin, length)
+
+    return fit_alignment(subs, find_subs_offset, lambda subs: correlation(ref_subs, subs), MAX_OFFSET, DRIFT_MIN_SCORE, MIN_CORRELATION)
+
+def envelope_cache_path(path, audio_id):
+    return media.cache_file("%s.a%s.t0.envelope.npy" % (media.fingerprint(path), audio_id))
+
+def has_envelope(path, audio_id):
+    return os.path.exists(envelope_cache_path(path, audio_id))
+
+def read_envelope(ffmpeg, path, audio_id, resolution=RESOLUTION, **kwargs):
+    """RMS energy of the audio stream per resolution seconds, decoded once and cached.
+    The cached envelope is memory-mapped."""
+    cache_path = envelope_cache_path(path, audio_id)
+    if os.path.exists(cache_path):
+        try:
+            return np.load(cache_path, mmap_mode="r")
+        except (OSError, ValueError):
+            pass
+
+    frame_size = int(round(ENVELOPE_SAMPLE_RATE * resolution))
+    chunk_size = frame_size * ENVELOPE_CHUNK_FRAMES * 2 # s16le
+    cmd = [ffmpeg, "-nostdin", "-v", "quiet", "-i", path, "-map", "0:a:%s" % audio_id, "-vn", "-sn"] + media.pad_start_options() + [
+        "-ac", "1", "-ar", str(ENVELOPE_SAMPLE_RATE), "-f", "s16le", "-"]
+    kwargs.update({"stdout": subprocess.PIPE, "stderr": subprocess.DEVNULL})
+    try:
+        p = subprocess.Popen(cmd, **kwargs)
+    except OSError:
+        return None
+
+    chunks = []
+    tail = b""
+    while True:
+        data = p.stdout.read(chunk_size)
+        if not data:
+            break
+        data = tail + data
+        num_frames = len(data) // (frame_size * 2)
+        tail = data[num_frames * frame_size * 2:]
+        if num_frames != 0:
+            samples = np.frombuffer(data, dtype="<i2", count=num_frames * frame_size).astype(np.float32) / 32768.0
+            chunks.append(np.sqrt(np.mean(np.square(samples.reshape(num_frames, frame_size)), axis=1)))
+    p.stdout.close()
+    if p.wait() != 0 or len(chunks) == 0:
+        return None
+
+    envelope = np.concatenate(chunks).astype(np.float32)
+    tmp_path = cache_path + ".part.npy"
+    np.save(tmp_path, envelope)
+    os.replace(tmp_path, cache_path)
+    return np.load(cache_path, mmap_mode="r")
+
+def speech_activity(envelope, origin, num_samples, resolution=RESOLUTION):
+    # log energy of the audio from origin, silence outside of it, minus the mean like activity()
+    level = np.log(envelope + 1e-4)
+    v = np.full(num_samples, level.min(), dtype=np.float32)
+    start = int(round(origin / resolution))
+    lo, hi = max(start, 0), min(start + num_samples, len(level))
+    if lo < hi:
+        v[lo - start:hi - start] = level[lo:hi]
+    return v - v.mean()
+
+def find_audio_offset(envelope, subs, max_offset, origin, length, resolution=RESOLUTION):
+    """Returns (offset, score) like find_offset, score is a correlation from -1 to 1."""
+    num_samples = int(length / resolution) + 1
+    a = speech_activity(envelope, origin, num_samples, resolution)
+    b = activity(subs, origin, num_samples, resolution)
+    lags, values = cross_correlation(a, b, min(int(max_offset / resolution), num_samples - 1))
+
+    best = np.argmax(values)
+    norm = np.sqrt(np.dot(a, a) * np.dot(b, b))
+    return lags[best] * resolution, (values[best] / norm if norm != 0 else 0.0)
+
+def audio_correlation(envelope, subs, resolution=RESOLUTION):
+    num_samples = len(envelope)
+    return normalized_correlation(speech_activity(envelope, 0.0, num_samples, resolution), activity(subs, 0.0, num_samples, resolution))
+
+def find_audio_alignment(envelope, subs, resolution=RESOLUTION):
+    """Returns (scale, shift) so that subs retimed to t * scale + shift follow the speech
+    in the envelope, (1.0, 0.0) if they can't be matched better or NumPy isn't installed."""
+    if np is None or envelope is None or len(envelope) == 0 or len(subs) == 0:
+        return 1.0, 0.0
+
+    def find_subs_offset(subs, max_offset, origin, length):
+        if length is None:
+            length = len(envelope) * resolution
+        return find_audio_offset(envelope, subs, max_offset, origin, length, resolution)
+
+    return fit_alignment(subs, find_subs_offset, lambda subs: audio_correlation(envelope, subs, resolution), AUDIO_MAX_OFFSET, AUDIO_MIN_CORRELATION, AUDIO_MIN_CORRELATION)
+
+def snap_to_silence(envelope, times, window=SNAP_WINDOW, resolution=RESOLUTION):
+    """Moves every time to the nearest silent frame within window seconds,
+    or to the quietest one if there is no silence around."""
+    times = np.asarray(times, dtype=np.float64)
+    if envelope is None or len(envelope) == 0 or len(times) == 0:
+        return times
+
+    threshold = np.quantile(envelope, SILENCE_QUANTILE)
+    offsets = np.arange(-int(window / resolution), int(window / resolution) + 1)
+    # one row of frames per time, read straight from the memory-mapped envelope
+    idx = np.clip(np.floor(times / resolution).astype(np.int64)[:, None] + offsets, 0, len(envelope) - 1)
+    energy = envelope[idx]
+
+    distance = np.where(energy <= threshold, np.abs(offsets), len(offsets))
+    best = np.argmin(distance, axis=1)
+    no_silence = distance[np.arange(len(times)), best] == len(offsets)
+    best[no_silence] = np.argmin(energy[no_silence], axis=1)
+
+    return (idx[np.arange(len(times)), best] + 0.5) * resolution
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+"""Benchmarks, run them from the Debug Console (Ctrl+Shift+;):
+
+    from <add-on folder>.bench import *
+    bench_add_notes()
+    bench_sync_subtitles()
+    bench_phrases()
+"""
+
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from . import phrases
+from .movies2anki import add_notes, add_pad_timings_between_phrases, change_subtitles_ending_time, convert_into_phrases, seconds_to_tsv_time, sync_subtitles
+from .track import SubtitleTrack
+
+FIELDS = ["Id", "Source", "Path", "Audio", "Audio Sound", "Video", "Video Sound", "Expression", "Meaning", "Notes"]
+
+def report(name, num_items, seconds, unit):
+    print("%s: %s %s in %.3f s, %d %s/s" % (name, num_items, unit, seconds, num_items / max(seconds, 1e-9), unit))
+
+def temp_collection():
+    from anki import Collection
+
+    tmp_dir = tempfile.mkdtemp(prefix="movies2anki")
+    col = Collection(os.path.join(tmp_dir, "collection.anki2"))
+
+    model = col.models.new("movies2anki (add-on)")
+    for name in FIELDS:
+        col.models.addField(model, col.models.newField(name))
+    t = col.models.newTemplate("Card 1")
+    t['qfmt'] = "[sound:{{Video}}]"
+    t['afmt'] = "{{Expression}}<br>{{Meaning}}"
+    col.models.addTemplate(model, t)
+    col.models.add(model)
+
+    return tmp_dir, col
+
+def make_notes(num_phrases):
+    notes = []
+    for idx in range(num_phrases):
+        name = "Episode_%s-%s" % (seconds_to_tsv_time(idx * 3), seconds_to_tsv_time(idx * 3 + 2))
+        notes.append({"Id": name, "Source": "Episode", "Path": "/tmp/Episode.mkv",
+            "Audio": name + ".mp3", "Video": name + ".mp4",
+            "Expression": "Phrase number %s." % idx, "Meaning": "Фраза номер %s." % idx})
+    return notes
+
+def add_notes_one_by_one(col, model_name, deck_name, notes):
+    # how write_tsv_file used to add notes
+    for fields in notes:
+        model = col.models.byName(model_name)
+        col.models.setCurrent(model)
+
+        note = col.newNote(forDeck=False)
+        for name, value in fields.items():
+            note[name] = value
+
+        did = col.decks.id(deck_name)
+        note.model()['did'] = did
+
+        col.addNote(note)
+
+    col.save()
+
+def bench_add_notes(num_phrases=2000):
+    notes = make_notes(num_phrases)
+
+    for name in ["one by one", "add_notes"]:
+        tmp_dir, col = temp_collection()
+        try:
+            time_start = time.time()
+            if name == "one by one":
+                add_notes_one_by_one(col, "movies2anki (add-on)", "Episode", notes)
+            else:
+                add_notes(col, col.models.byName("movies2anki (add-on)"), col.decks.id("Episode"), notes)
+            report(name, col.noteCount(), time.time() - time_start, "notes")
+        finally:
+            col.close()
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def make_subs(num_lines, seed, prefix):
+    # subtitles of a movie or of a season of episodes put one after another
+    rnd = random.Random(seed)
+    subs = []
+    t = 0.0
+    for idx in range(num_lines):
+        t += rnd.uniform(0.1, 3.0)
+        duration = rnd.uniform(0.5, 6.0)
+        subs.append((t, t + duration, "%s %s" % (prefix, idx)))
+        t += duration
+    return subs
+
+def sync_subtitles_one_by_one(en_subs, ru_subs):
+    # how sync_subtitles used to compare every pair of subtitles
+    subs = []
+    for en_sub_start, en_sub_end, en_sub_content in en_subs:
+        sub_content = []
+        for ru_sub_start, ru_sub_end, ru_sub_content in ru_subs:
+            if ru_sub_start < en_sub_start:
+                if (ru_sub_end > en_sub_start and ru_sub_end < en_sub_end) or ru_sub_end >= en_sub_end:
+                    sub_content.append(ru_sub_content)
+            elif ru_sub_start < en_sub_end:
+                sub_content.append(ru_sub_content)
+        subs.append((en_sub_start, en_sub_end, " ".join(sub_content)))
+    return subs
+
+def bench_sync_subtitles(sizes=(2000, 26 * 2000), max_one_by_one=2000):
+    for num_lines in sizes:
+        en_subs = make_subs(num_lines, 1, "en")
+        ru_subs = make_subs(num_lines, 2, "ru")
+
+        time_start = time.time()
+        subs = sync_subtitles(en_subs, ru_subs)
+        report("sync_subtitles", num_lines, time.time() - time_start, "lines")
+
+        if num_lines <= max_one_by_one:
+            time_start = time.time()
+            assert sync_subtitles_one_by_one(en_subs, ru_subs) == subs
+            report("one by one", num_lines, time.time() - time_start, "lines")
+
+def bench_phrases(num_lines=50000):
+    en_subs = make_subs(num_lines, 1, "en")
+
+    results = []
+    for use_numpy in [False, True]:
+        if use_numpy and not phrases.np:
+            print("NumPy isn't installed")
+            break
+
+        phrases.USE_NUMPY = use_numpy
+        try:
+            sentences = SubtitleTrack(en_subs)
+            time_start = time.time()
+            subs, subs_with_line_timings = convert_into_phrases(sentences, 1.25, 20, True, " ")
+            add_pad_timings_between_phrases(subs, 0.25, 0.25)
+            change_subtitles_ending_time(subs)
+            report("NumPy" if use_numpy else "Python", num_lines, time.time() - time_start, "lines")
+        finally:
+            phrases.USE_NUMPY = True
+
+        results.append((list(subs), [list(group) for group in subs_with_line_timings]))
+
+    assert all(r == results[0] for r in results)
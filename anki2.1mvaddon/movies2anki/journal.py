@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+"""Persistent journal of media jobs, so interrupted runs redo only unfinished work."""
+
+import json
+import os
+import sqlite3
+import time
+
+JOURNAL_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "jobs.db")
+
+PENDING = "pending"
+DONE = "done"
+
+# jobs are forgotten after this many seconds, pending ones too: their notes may be gone
+KEEP_JOBS = 30 * 24 * 3600
+
+class JobJournal(object):
+    """Must be used from the thread that created it (sqlite3 restriction)."""
+
+    def __init__(self, path=JOURNAL_FILE):
+        self.db = sqlite3.connect(path)
+        self.db.execute("create table if not exists jobs (filename text primary key, kind text not null, args text not null, state text not null, mod integer not null)")
+        self.db.execute("delete from jobs where mod < ?", (int(time.time()) - KEEP_JOBS,))
+        self.db.commit()
+        self.done = None
+
+    def close(self):
+        self.db.close()
+
+    def add(self, jobs):
+        """Records (filename, kind, args) jobs as pending."""
+        now = int(time.time())
+        self.db.executemany("insert or replace into jobs (filename, kind, args, state, mod) values (?, ?, ?, ?, ?)",
+            [(os.path.abspath(filename), kind, json.dumps(args), PENDING, now) for filename, kind, args in jobs])
+        self.db.commit()
+
+    def mark_done(self, filenames):
+        now = int(time.time())
+        self.db.executemany("update jobs set state = ?, mod = ? where filename = ?", [(DONE, now, os.path.abspath(f)) for f in filenames])
+        self.db.commit()
+        if self.done is not None:
+            self.done.update(os.path.abspath(f) for f in filenames)
+
+    def is_done(self, filename, media_index):
+        """True if the job finished and its output is still in media_index (a media.MediaIndex)."""
+        if self.done is None:
+            self.done = set(f for f, in self.db.execute("select filename from jobs where state = ?", (DONE,)))
+        return os.path.abspath(filename) in self.done and media_index.exists(filename)
+
+    def pending(self, kind):
+        """(filename, args) of the pending jobs, jobs whose source file is gone are dropped."""
+        jobs = []
+        stale = []
+        sources = {}
+        for filename, args in self.db.execute("select filename, args from jobs where kind = ? and state = ? order by filename", (kind, PENDING)):
+            args = json.loads(args)
+            path = args.get("path")
+            if path is not None and path not in sources:
+                sources[path] = os.path.exists(path)
+            if path is not None and not sources[path]:
+                stale.append((filename,))
+            else:
+                jobs.append((filename, args))
+
+        if len(stale) != 0:
+            self.db.executemany("delete from jobs where filename = ?", stale)
+            self.db.commit()
+
+        return jobs
+
+def part_filename(filename):
+    """Temporary name an output is written to before it is renamed to filename."""
+    root, ext = os.path.splitext(filename)
+    return root + ".part" + ext
+
+def commit_part(filename, success):
+    part = part_filename(filename)
+    if success:
+        os.replace(part, filename)
+    elif os.path.exists(part):
+        os.remove(part)
@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+
+"""Helpers for running ffmpeg/ffprobe jobs."""
+
+import bisect
+import hashlib
+import json
+import os
+import subprocess
+import threading
+import time
+
+from array import array
+
+POLL_INTERVAL = 0.05
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+
+PCM_FORMAT = "s16le"
+PCM_SAMPLE_RATE = 44100
+PCM_CHANNELS = 2
+# decoded audio starts at the container start, not at the first sample, so -ss keeps
+# the same meaning for a stream with a start delay (common in MKV and TS files)
+PAD_START_FILTER = "aresample=async=1:first_pts=0"
+
+# Audio codecs that can be cut without re-encoding and the container to cut them into
+COPY_AUDIO_CODECS = {"mp3": ".mp3", "aac": ".m4a"}
+# H.264 profiles that play everywhere the re-encoded baseline clips do
+COPY_VIDEO_PROFILES = ["Baseline", "Constrained Baseline"]
+
+def default_max_processes():
+    return os.cpu_count() or 1
+
+class ProcessPool(object):
+    """Runs up to max_processes subprocesses at the same time.
+
+    submit() blocks while the pool is full. The callback of a job is called
+    with the process return code from the thread that calls submit(), poll()
+    or wait(), so a QThread can emit its signals from there.
+    """
+
+    def __init__(self, max_processes=0):
+        if max_processes <= 0:
+            max_processes = default_max_processes()
+
+        self.max_processes = max_processes
+        self.processes = []
+        self.canceled = False
+        self.lock = threading.Lock()
+
+    def submit(self, cmd, callback=None, **kwargs):
+        while len(self.processes) >= self.max_processes and not self.canceled:
+            if self.poll() == 0:
+                time.sleep(POLL_INTERVAL)
+
+        with self.lock:
+            if self.canceled:
+                return None
+
+            p = subprocess.Popen(cmd, **kwargs)
+            self.processes.append((p, callback))
+
+        return p
+
+    def poll(self):
+        with self.lock:
+            finished = [job for job in self.processes if job[0].poll() is not None]
+            self.processes = [job for job in self.processes if job not in finished]
+
+        for p, callback in finished:
+            if callback is not None:
+                callback(p.returncode)
+
+        return len(finished)
+
+    def wait(self):
+        while len(self.processes) != 0:
+            if self.poll() == 0:
+                time.sleep(POLL_INTERVAL)
+
+    def terminate(self):
+        with self.lock:
+            self.canceled = True
+
+            for p, callback in self.processes:
+                if p.poll() is None:
+                    p.terminate()
+
+def split_into_segments(clips, max_clips, max_gap):
+    """Groups clips (path, start, duration, ...) into runs of the same file
+    that can be cut by a single ffmpeg process."""
+    segments = []
+    segment_end = 0
+
+    for clip in sorted(clips, key=lambda c: (c[0], c[1])):
+        path, start, duration = clip[:3]
+
+        if len(segments) != 0:
+            segment = segments[-1]
+            if segment[0][0] == path and len(segment) < max_clips and start - segment_end <= max_gap:
+                segment.append(clip)
+                segment_end = max(segment_end, start + duration)
+                continue
+
+        segments.append([clip])
+        segment_end = start + duration
+
+    return segments
+
+class MediaIndex(object):
+    """Names and sizes of the files in a directory, read with a single scan.
+
+    Empty files are left over by failed ffmpeg runs and count as missing.
+    """
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        self.sizes = {}
+
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.is_file():
+                    self.sizes[entry.name] = entry.stat().st_size
+            except OSError:
+                pass
+
+    def __contains__(self, name):
+        return self.sizes.get(name, 0) > 0
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def exists(self, path):
+        directory, name = os.path.split(os.path.join(self.directory, path))
+        if directory != self.directory:
+            return os.path.exists(path) and os.path.getsize(path) > 0
+        return name in self
+
+def fingerprint(path):
+    """Cheap identity of a media file: size, mtime and its first and last 64 KiB."""
+    st = os.stat(path)
+
+    h = hashlib.sha1()
+    h.update(("%s:%s" % (st.st_size, int(st.st_mtime))).encode("utf-8"))
+    with open(path, "rb") as f:
+        h.update(f.read(65536))
+        f.seek(max(0, st.st_size - 65536))
+        h.update(f.read(65536))
+
+    return h.hexdigest()
+
+def cache_dir():
+    if not os.path.isdir(CACHE_DIR):
+        os.makedirs(CACHE_DIR)
+
+    return CACHE_DIR
+
+def cache_file(name):
+    return os.path.join(cache_dir(), name)
+
+def audio_cache_path(path, audio_id):
+    return cache_file("%s.a%s.t0.pcm" % (fingerprint(path), audio_id))
+
+def is_audio_cache(path):
+    return path.endswith(".pcm")
+
+def pad_start_options():
+    return ["-af", PAD_START_FILTER]
+
+def pcm_options():
+    return ["-f", PCM_FORMAT, "-ar", str(PCM_SAMPLE_RATE), "-ac", str(PCM_CHANNELS)]
+
+def prune_cache(max_size, suffix):
+    """Removes the least recently used cache files until they fit in max_size bytes."""
+    if not os.path.isdir(CACHE_DIR):
+        return
+
+    files = []
+    for entry in os.scandir(CACHE_DIR):
+        if entry.is_file() and entry.name.endswith(suffix):
+            st = entry.stat()
+            files.append((max(st.st_atime, st.st_mtime), st.st_size, entry.path))
+
+    total_size = sum(f[1] for f in files)
+    for atime, size, path in sorted(files):
+        if total_size <= max_size:
+            break
+
+        try:
+            os.remove(path)
+            total_size -= size
+        except OSError:
+            pass
+
+def probe_streams(ffprobe, path, **kwargs):
+    try:
+        output = subprocess.check_output([ffprobe, "-v", "quiet", "-print_format", "json", "-show_streams", path], **kwargs)
+    except (OSError, subprocess.CalledProcessError):
+        return []
+
+    return json.loads(output.decode("utf-8")).get("streams", [])
+
+def select_streams(streams, codec_type):
+    return [s for s in streams if s.get("codec_type") == codec_type and not s.get("disposition", {}).get("attached_pic")]
+
+def audio_copy_extension(streams, audio_id):
+    audio_streams = select_streams(streams, "audio")
+    if audio_id >= len(audio_streams):
+        return None
+
+    return COPY_AUDIO_CODECS.get(audio_streams[audio_id].get("codec_name"))
+
+def can_copy_video(streams, max_width, max_level):
+    """True if the first video stream is no harder to play than a re-encoded clip: H.264 baseline up to max_level (30 is 3.0) and max_width."""
+    video_streams = select_streams(streams, "video")
+    if len(video_streams) == 0:
+        return False
+
+    video = video_streams[0]
+    if video.get("codec_name") != "h264" or video.get("pix_fmt") != "yuv420p" or video.get("profile") not in COPY_VIDEO_PROFILES:
+        return False
+    return 0 < video.get("level", 0) <= max_level and 0 < video.get("width", 0) <= max_width
+
+def frame_duration(streams, default=0.1):
+    video_streams = select_streams(streams, "video")
+    if len(video_streams) == 0:
+        return default
+
+    num, _, den = video_streams[0].get("avg_frame_rate", "0/0").partition("/")
+    try:
+        return float(den or 1) / float(num)
+    except (ValueError, ZeroDivisionError):
+        return default
+
+def group_snapshots(snapshots, min_gap):
+    """Merges (time, filename) snapshots closer than min_gap into (time, [filenames]).
+
+    A frame can be selected only once, so snapshots that would fall on the
+    same frame are taken from one image.
+    """
+    groups = []
+    for t, filename in sorted(snapshots):
+        if len(groups) != 0 and t - groups[-1][0] < min_gap:
+            groups[-1][1].append(filename)
+        else:
+            groups.append((t, [filename]))
+
+    return groups
+
+def snapshot_filter(times, scale):
+    # selects the first frame at or after every time
+    expr = "+".join("gte(t,%.3f)*not(gte(prev_t,%.3f))" % (t, t) for t in times)
+    return "select='%s',%s" % (expr, scale)
+
+def snapshot_output_options():
+    # every image is named by its time in milliseconds from -ss
+    return ["-vsync", "0", "-enc_time_base", "1:1000", "-frame_pts", "1"]
+
+def match_snapshots(images, times):
+    """The image of every time from images named by snapshot_output_options(), None if it wasn't selected.
+
+    Times that fall on the same frame get the same image.
+    """
+    frames = sorted((int(os.path.splitext(image)[0]), image) for image in images)
+    frame_times = [ms for ms, image in frames]
+    matched = []
+    for t in times:
+        # pts are rounded to milliseconds
+        idx = bisect.bisect_left(frame_times, int(round(t * 1000)) - 1)
+        matched.append(frames[idx][1] if idx < len(frames) else None)
+    return matched
+
+class KeyframeIndex(object):
+    """Keyframe timestamps of the first video stream."""
+
+    def __init__(self, times):
+        self.times = times
+
+    def __len__(self):
+        return len(self.times)
+
+    def preceding(self, t, tolerance=None):
+        """The last keyframe at or before t, None if there is none within tolerance seconds."""
+        idx = bisect.bisect_right(self.times, t) - 1
+        if idx < 0 or (tolerance is not None and t - self.times[idx] > tolerance):
+            return None
+        return self.times[idx]
+
+def keyframe_index_path(path):
+    return cache_file("%s.keyframes" % fingerprint(path))
+
+def load_keyframe_index(path):
+    try:
+        index_path = keyframe_index_path(path)
+        with open(index_path, "rb") as f:
+            count = array("q")
+            count.fromfile(f, 1)
+            times = array("d")
+            times.fromfile(f, count[0])
+    except (OSError, EOFError):
+        return None
+
+    return KeyframeIndex(times)
+
+def build_keyframe_index(ffprobe, path, **kwargs):
+    """Scans the packets of the first video stream once and saves its keyframes."""
+    index = load_keyframe_index(path)
+    if index is not None:
+        return index
+
+    try:
+        output = subprocess.check_output([ffprobe, "-v", "quiet", "-select_streams", "v:0",
+            "-show_entries", "packet=pts_time,flags:format=start_time", "-of", "csv=p=0", path], **kwargs)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    # ffmpeg -ss is relative to the start time of the file
+    start_time = 0.0
+    keyframes = []
+    for line in output.decode("utf-8").splitlines():
+        fields = line.split(",")
+        if len(fields) == 1 and fields[0] not in ("", "N/A"):
+            start_time = float(fields[0])
+        if len(fields) < 2 or "K" not in fields[1] or fields[0] in ("", "N/A"):
+            continue
+        keyframes.append(float(fields[0]))
+    keyframes.sort()
+
+    times = array("d", [t - start_time for t in keyframes])
+
+    index_path = keyframe_index_path(path)
+    with open(index_path + ".tmp", "wb") as f:
+        array("q", [len(times)]).tofile(f)
+        times.tofile(f)
+    os.replace(index_path + ".tmp", index_path)
+
+    return KeyframeIndex(times)
@@ -7,28 +7,40 @@ from PyQt5.QtWidgets import *
 from aqt.qt import *
 
 from aqt.utils import showInfo
+from anki.notes import Note
+from anki.utils import splitFields
 
+import bisect
+import heapq
 import json
 import os
 import re
 import shutil
 import string
 import sys
+import tempfile
 import time
+import traceback
 
 from collections import deque
 #from .ConfigParser import SafeConfigParser
 from .configparser.src.configparser import ConfigParser
 from subprocess import call
 from subprocess import check_output
-from subprocess import Popen
 from .asstosrt import asstosrt
 
 import subprocess
 import os.path
 
+from . import align
 from . import glob
+from . import journal
+from . import media
+from . import phrases
+from . import srt
 from . import styles
+from . import timecode
+from .track import SubtitleTrack, TrackGroups
 
 # Determine if we're frozen with Pyinstaller or not.
 if getattr(sys, 'frozen', False):
@@ -87,34 +99,22 @@ def subprocess_args(include_stdout=True):
     return ret
 
 def srt_time_to_seconds(time):
-    split_time = time.split(',')
-    major, minor = (split_time[0].split(':'), split_time[1])
-    return int(major[0]) * 3600 + int(major[1]) * 60 + int(major[2]) + float(minor) / 1000
+    return timecode.to_seconds(timecode.parse(time))
 
 def tsv_time_to_seconds(tsv_time):
-    return srt_time_to_seconds(tsv_time.replace(".", ","))
+    return timecode.to_seconds(timecode.parse(tsv_time))
 
 def get_time_parts(time):
-    millisecs = str(time).split(".")[1][:3]
-    if len(millisecs) != 3:
-        millisecs = millisecs + ('0' * (3 - len(millisecs)))
-    millisecs = int(millisecs)
-    mins, secs = divmod(time, 60)
-    hours, mins = divmod(mins, 60)
-
-    return (hours, mins, secs, millisecs)
+    return timecode.parts(timecode.to_ms(time))
 
 def seconds_to_srt_time(time):
-    return '%02d:%02d:%02d,%03d' % get_time_parts(time)
+    return timecode.format_srt(timecode.to_ms(time))
 
 def seconds_to_tsv_time(time):
-    return '%d.%02d.%02d.%03d' % get_time_parts(time)
+    return timecode.format_tsv(timecode.to_ms(time))
 
 def seconds_to_ffmpeg_time(time):
-    return '%02d:%02d:%02d.%03d' % get_time_parts(time)
-
-def fix_empty_lines(content):
-    return re.sub('\n\n+', '\n\n', content)
+    return timecode.format_ffmpeg(timecode.to_ms(time))
 
 def escape_double_quotes(content):
     return re.sub('"', '&quot;', content)
@@ -139,48 +139,41 @@ def is_not_sdh_subtitle(sub):
 
     return True
 
-def read_subtitles(content, is_ignore_SDH, join_lines_separator, join_sentences_separator):
+def read_cues(cues, is_ignore_SDH, join_lines_separator, join_sentences_separator):
     en_subs = []
     
-    for sub in content.strip().split('\n\n'):
-        sub_chunks = sub.split('\n')
-        if (len(sub_chunks) >= 3):
-            sub_timecode =  sub_chunks[1].split(' --> ')
-            
-            sub_start = srt_time_to_seconds(sub_timecode[0].strip())
-            sub_end = srt_time_to_seconds(sub_timecode[1].strip())
-            # sub_content = join_lines_separator.join(sub_chunks[2:])
-
-            sub_content = sub_chunks[2:][0]
-            for sub_line in sub_chunks[2:][1:]:
-                if sub_content[-1] not in [".", "?", "!", "？", "！", "♪"]:
-                    sub_content += join_lines_separator
-                else:
-                    sub_content += join_sentences_separator
-                sub_content += sub_line
+    for sub_start, sub_end, sub_lines in cues:
+        # sub_content = join_lines_separator.join(sub_lines)
 
-            sub_content = re.sub(r"\t", " ", sub_content)
-            sub_content = re.sub(r"\n +", "\n", sub_content)
-            sub_content = re.sub(r"  +", " ", sub_content)
-            sub_content = sub_content.strip()
+        sub_content = sub_lines[0]
+        for sub_line in sub_lines[1:]:
+            if sub_content[-1] not in [".", "?", "!", "？", "！", "♪"]:
+                sub_content += join_lines_separator
+            else:
+                sub_content += join_sentences_separator
+            sub_content += sub_line
+
+        sub_content = re.sub(r"\t", " ", sub_content)
+        sub_content = re.sub(r"\n +", "\n", sub_content)
+        sub_content = re.sub(r"  +", " ", sub_content)
+        sub_content = sub_content.strip()
 
-            if len(sub_content) > 0:
-                if not is_ignore_SDH:
+        if len(sub_content) > 0:
+            if not is_ignore_SDH:
+                en_subs.append((sub_start, sub_end, sub_content))
+            else:
+                if is_not_sdh_subtitle(sub_content):
                     en_subs.append((sub_start, sub_end, sub_content))
-                else:
-                    if is_not_sdh_subtitle(sub_content):
-                        en_subs.append((sub_start, sub_end, sub_content))
-                    # else:
-                    #     print "Ignore subtitle: %s" % repr(sub_content)
-            # else:
-            #     print "Empty subtitle: %s" % repr(sub)
+                # else:
+                #     print "Ignore subtitle: %s" % repr(sub_content)
         # else:
-        #     print "Ignore subtitle: %s" % repr(sub)
+        #     print "Empty subtitle: %s" % repr(sub_lines)
    
-    return en_subs
+    return SubtitleTrack(en_subs)
 
 # Формат субтитров
 # [(start_time, end_time, subtitle), (), ...], [(...)], ...
+# SubtitleTrack хранит их в массивах, но ведёт себя так же
 def join_lines_within_subs(subs, join_sentences_separator):
     subs_joined = []
 
@@ -198,7 +191,7 @@ def join_lines_within_subs(subs, join_sentences_separator):
         if sub_end - sub_start > duration_longest_phrase:
             duration_longest_phrase = int(sub_end - sub_start)
 
-    return subs_joined
+    return SubtitleTrack(subs_joined)
 
 def split_long_phrases(en_subs, phrases_duration_limit):
     subs = []
@@ -232,15 +225,35 @@ def split_long_phrases(en_subs, phrases_duration_limit):
 
     return subs
 
+TAG_RE = re.compile(r"<[^>]+>")
+SPACES_RE = re.compile(r"  +")
+
 def remove_tags(sub):
-    sub = re.sub(r"<[^>]+>", "", sub)
-    sub = re.sub(r"  +", " ", sub)
+    sub = TAG_RE.sub("", sub)
+    sub = SPACES_RE.sub(" ", sub)
     sub = sub.strip()
 
     return sub
 
+def compile_line_endings(join_lines_that_end_with):
+    """One pattern for the endings separated by spaces, anchored like re.search(regex + "$")."""
+    regexes = join_lines_that_end_with.split()
+    if len(regexes) == 0:
+        return []
+
+    # numbered groups of one ending would be shifted by the other ones, and an inline
+    # flag such as (?i) applies to the whole pattern, or is an error from Python 3.11
+    if not any(re.search(r"\\\d|\(\?P=|\(\?[aiLmsux]+\)", regex) for regex in regexes):
+        try:
+            return [re.compile("|".join("(?:%s$)" % regex for regex in regexes))]
+        except re.error:
+            pass
+
+    return [re.compile(regex + r"$") for regex in regexes]
+
 def convert_into_sentences(en_subs, phrases_duration_limit, join_lines_that_end_with, join_questions_with_answers, join_sentences_separator, join_lines_separator):
     subs = []
+    line_endings = compile_line_endings(join_lines_that_end_with)
 
     for sub in en_subs:
         sub_start = sub[0]
@@ -254,24 +267,22 @@ def convert_into_sentences(en_subs, phrases_duration_limit, join_lines_that_end_
             prev_sub_end = subs[-1][1]
             prev_sub_content_original = subs[-1][2]
 
-            prev_sub_content = remove_tags(prev_sub_content_original)
-
-            flag = False
-            for regex in join_lines_that_end_with.split():
-                if re.search(regex + r"$", prev_sub_content):
-                    flag = True
-                    break
-
             if (prev_sub_content.endswith("?") or prev_sub_content.endswith("？")) and join_questions_with_answers and (sub_start - prev_sub_end) <= 5:
                 subs[-1] = (prev_sub_start, sub_end, prev_sub_content_original + join_sentences_separator + sub_content_original)
-            elif flag and (sub_start - prev_sub_end) <= 10:
+            elif (sub_start - prev_sub_end) <= 10 and any(regex.search(prev_sub_content) for regex in line_endings):
                 subs[-1] = (prev_sub_start, sub_end, prev_sub_content_original + join_lines_separator + sub_content_original)
             else:
                 subs.append((sub_start, sub_end, sub_content_original))
+                prev_sub_content = sub_content
+                continue
+
+            # tags can span the joined lines, only the joined text is stripped again
+            prev_sub_content = remove_tags(subs[-1][2])
         else:
             subs.append((sub_start, sub_end, sub_content_original))
+            prev_sub_content = sub_content
 
-    return subs
+    return SubtitleTrack(subs)
 
 # Unused
 def convert_into_sentences_source(en_subs, phrases_duration_limit):
@@ -313,6 +324,13 @@ def convert_into_sentences_source(en_subs, phrases_duration_limit):
     return subs
 
 def convert_into_phrases(en_subs, time_delta, phrases_duration_limit, is_split_long_phrases, join_sentences_separator):
+    if phrases.is_enabled():
+        result = phrases.convert_into_phrases(en_subs, time_delta, phrases_duration_limit, is_split_long_phrases, join_sentences_separator)
+        if result is not None:
+            global duration_longest_phrase
+            subs, subs_with_line_timings, duration_longest_phrase = result
+            return (subs, subs_with_line_timings)
+
     subs = []
 
     for sub in en_subs:
@@ -330,70 +348,89 @@ def convert_into_phrases(en_subs, time_delta, phrases_duration_limit, is_split_l
     if is_split_long_phrases:
         subs = split_long_phrases(subs, phrases_duration_limit)
         
-    subs_with_line_timings = subs
+    subs_with_line_timings = TrackGroups(subs)
 
     subs = join_lines_within_subs(subs, join_sentences_separator)
     return (subs, subs_with_line_timings)
 
 def sync_subtitles(en_subs, ru_subs):
-    subs = []
-
-    for en_sub in en_subs:
-        en_sub_start = en_sub[0]
-        en_sub_end = en_sub[1]
-        sub_content = []
-
-        subs.append((en_sub_start, en_sub_end, sub_content))
-
-        for ru_sub in ru_subs:
-            ru_sub_start = ru_sub[0]
-            ru_sub_end = ru_sub[1]
-            ru_sub_content = ru_sub[2]
-
-            if ru_sub_start < en_sub_start:
-                if ru_sub_end > en_sub_start and ru_sub_end < en_sub_end:
-                    sub_content.append(ru_sub_content) # TODO
-                elif ru_sub_end >= en_sub_end:
-                    sub_content.append(ru_sub_content) 
-            elif ru_sub_start >= en_sub_start and ru_sub_start < en_sub_end:
-                if ru_sub_end <= en_sub_end:
-                    sub_content.append(ru_sub_content)
-                elif ru_sub_end > en_sub_end:
-                    sub_content.append(ru_sub_content) # TODO
-
-    tmp_subs = subs
-    subs = []
-
-    for sub in tmp_subs:
-        sub_start = sub[0]
-        sub_end = sub[1]
-        sub_content = " ".join(sub[2])
-
-        subs.append((sub_start, sub_end, sub_content))
-
-    return subs
+    return sync_subtitle_tracks(en_subs, [ru_subs])[0]
+
+def sync_subtitle_tracks(en_subs, tracks):
+    # ru_sub goes with en_sub if it starts inside en_sub or starts before it and ends after its start
+    # the tracks are merged into one stream of (start, track, idx) sorted by start
+    # tuples are indexed faster than a SubtitleTrack
+    en_subs = list(en_subs)
+    tracks = [list(subs) for subs in tracks]
+    stream = list(heapq.merge(*[sorted((sub[0], track, idx) for idx, sub in enumerate(subs)) for track, subs in enumerate(tracks)]))
+    starts = [item[0] for item in stream]
+
+    contents = [[None] * len(en_subs) for subs in tracks]
+    active = [] # (end, track, idx) of subtitles that started before the current en_sub
+    pos = 0
+
+    for en_idx in sorted(range(len(en_subs)), key=lambda idx: en_subs[idx][0]):
+        en_sub_start = en_subs[en_idx][0]
+        en_sub_end = en_subs[en_idx][1]
+
+        if en_sub_end <= en_sub_start:
+            for track, subs in enumerate(tracks):
+                sub_content = [ru_sub[2] for ru_sub in subs if ru_sub[0] < en_sub_start and ru_sub[1] >= en_sub_end]
+                contents[track][en_idx] = " ".join(sub_content)
+            continue
+
+        while pos < len(stream) and starts[pos] < en_sub_start:
+            start, track, idx = stream[pos]
+            heapq.heappush(active, (tracks[track][idx][1], track, idx))
+            pos += 1
+
+        while len(active) != 0 and active[0][0] <= en_sub_start:
+            heapq.heappop(active)
+
+        matched = [(track, idx) for end, track, idx in active]
+        matched += [(track, idx) for start, track, idx in stream[pos:bisect.bisect_left(starts, en_sub_end, pos)]]
+        matched.sort()
+
+        for track, subs in enumerate(tracks):
+            contents[track][en_idx] = " ".join(subs[idx][2] for t, idx in matched if t == track)
+
+    en_starts = [en_sub[0] for en_sub in en_subs]
+    en_ends = [en_sub[1] for en_sub in en_subs]
+    return [SubtitleTrack.from_arrays(en_starts, en_ends, contents[track]) for track in range(len(tracks))]
 
 def add_pad_timings_between_phrases(subs, shift_start, shift_end):
-    for idx in range(len(subs)):
-        (start_time, end_time, subtitle) = subs[idx]
-        subs[idx] = (start_time - shift_start, end_time + shift_end, subtitle)
+    if phrases.is_enabled():
+        phrases.shift(subs, -shift_start, shift_end)
+    else:
+        subs.shift(-shift_start, shift_end)
     
     (start_time, end_time, subtitle) = subs[0]
     if start_time < 0:
         subs[0] = (0.0, end_time, subtitle)
 
+def snap_phrases_to_silence(subs, envelope, shift_start, shift_end):
+    # padded boundaries move to silence but never into the phrase itself
+    starts = align.snap_to_silence(envelope, [sub[0] for sub in subs])
+    ends = align.snap_to_silence(envelope, [sub[1] for sub in subs])
+    for idx in range(len(subs)):
+        (start_time, end_time, subtitle) = subs[idx]
+        start_time = max(0.0, min(float(starts[idx]), start_time + max(shift_start, 0)))
+        end_time = max(float(ends[idx]), end_time - max(shift_end, 0))
+        subs[idx] = (start_time, end_time, subtitle)
+
 def add_empty_subtitle(subs):
     (start_time, end_time, subtitle) = subs[0][0]
     if start_time > 15:
         subs.insert(0, [(0.0, start_time, "")])
 
 def change_subtitles_ending_time(subs):
-    for idx in range(1, len(subs)):
-        (start_time, end_time, subtitle) = subs[idx]
-        (prev_start_time, prev_end_time, prev_subtitle) = subs[idx - 1]
-
-        if prev_end_time < start_time:
-            subs[idx - 1] = (prev_start_time, start_time, prev_subtitle)
+    if phrases.is_enabled():
+        phrases.extend_endings(subs)
+    else:
+        starts, ends = subs.starts, subs.ends
+        for idx in range(1, len(subs)):
+            if ends[idx - 1] < starts[idx]:
+                ends[idx - 1] = starts[idx]
 
     (start_time, end_time, subtitle) = subs[0]
     if start_time > 15:
@@ -413,6 +450,18 @@ def find_glob_files(glob_pattern):
 
     return glob.glob(glob_pattern)
 
+def split_subtitle_files(filenames):
+    # Subs 2 can be several files separated by os.pathsep, an empty one keeps the place of a missing track
+    tracks = [filename.strip() for filename in filenames.split(os.pathsep)]
+    while len(tracks) != 0 and len(tracks[-1]) == 0:
+        tracks.pop()
+    return tracks
+
+def meaning_field(track):
+    if track == 0:
+        return "Meaning"
+    return "Meaning %s" % (track + 1)
+
 def guess_srt_file(video_file, mask_list, default_filename):
     for mask in mask_list:
         glob_pattern = video_file[:-4] + mask
@@ -463,6 +512,124 @@ def create_or_clean_collection_dir(directory):
 
     return True
 
+def add_notes(col, model, did, notes):
+    # notes are dicts of field values, all of them are added with a single commit
+    col.models.setCurrent(model)
+    model['did'] = did
+
+    for fields in notes:
+        note = Note(col, model)
+        for name, value in fields.items():
+            note[name] = value
+        col.addNote(note)
+
+    col.save()
+
+NOTE_ID_RE = re.compile(r"^(.*)_(\d+\.\d\d\.\d\d\.\d+)-(\d+\.\d\d\.\d\d\.\d+)$")
+
+def parse_note_id(note_id):
+    # (prefix, start ms, end ms) of an Id field, None if it has no timings
+    m = NOTE_ID_RE.match(note_id)
+    if m is None:
+        return None
+    return (m.group(1), timecode.parse(m.group(2)), timecode.parse(m.group(3)))
+
+def note_id_keys(prefix, start_ms, end_ms):
+    # Ids written before the timings were rounded once can be 1 ms off
+    return [(prefix, start_ms + ds, end_ms + de) for ds in (0, -1, 1) for de in (0, -1, 1)]
+
+SNAPSHOT_RE = re.compile(r'<img src="(.*_(\d+\.\d\d\.\d\d\.\d+)\.jpg)"')
+
+def snapshot_jobs(media_dir, notes):
+    # journal entries of the snapshots of notes, a canceled run leaves them to "Generate Mobile Cards..."
+    jobs = []
+    for note in notes:
+        m = SNAPSHOT_RE.match(note.get("Snapshot", ""))
+        if m is not None:
+            jobs.append((os.path.join(media_dir, m.group(1)), "snapshot", {"path": note["Path"], "time": timecode.to_seconds(timecode.parse(m.group(2)))}))
+    return jobs
+
+def find_existing_ids(col, model, deck):
+    # parse_note_id() of the notes of a model that have cards in the deck, or in a filtered deck from it
+    ids = set()
+    if deck is None:
+        return ids
+
+    idx = col.models.fieldMap(model)["Id"][0]
+    for flds, in col.db.execute("select flds from notes where mid = ? and id in (select nid from cards where did = ? or odid = ?)", model['id'], deck['id'], deck['id']):
+        key = parse_note_id(splitFields(flds)[idx])
+        if key is not None:
+            ids.add(key)
+
+    return ids
+
+def update_notes(col, note_updates):
+    # (nid, {field: value}) pairs, fields the model doesn't have are ignored
+    for nid, fields in note_updates:
+        note = col.getNote(nid)
+
+        changed = False
+        for name, value in fields.items():
+            if name in note and note[name] != value:
+                note[name] = value
+                changed = True
+
+        if changed:
+            note.flush()
+
+    col.save()
+
+def find_existing_phrases(col, model, sources):
+    # (start, end, nid, Id) of the notes of a model for every Source, sorted by start
+    field_map = col.models.fieldMap(model)
+    id_idx = field_map["Id"][0]
+    source_idx = field_map["Source"][0]
+
+    phrases = dict((source, []) for source in sources)
+    for nid, flds in col.db.execute("select id, flds from notes where mid = ?", model['id']):
+        fields = splitFields(flds)
+        if fields[source_idx] not in phrases:
+            continue
+
+        key = parse_note_id(fields[id_idx])
+        if key is None:
+            continue
+
+        start, end = timecode.to_seconds(key[1]), timecode.to_seconds(key[2])
+        phrases[fields[source_idx]].append((start, end, nid, fields[id_idx]))
+
+    for source in phrases:
+        phrases[source].sort()
+
+    return phrases
+
+def match_phrases(subs, phrases):
+    # index of the phrase that overlaps each subtitle the most, every phrase is matched once
+    matches = []
+    used = set()
+
+    j = 0
+    for sub in subs:
+        start, end = sub[0], sub[1]
+        while j < len(phrases) and phrases[j][1] <= start:
+            j += 1
+
+        best = None
+        best_overlap = 0
+        k = j
+        while k < len(phrases) and phrases[k][0] < end:
+            overlap = min(end, phrases[k][1]) - max(start, phrases[k][0])
+            if overlap > best_overlap and k not in used:
+                best = k
+                best_overlap = overlap
+            k += 1
+
+        if best is not None:
+            used.add(best)
+        matches.append(best)
+
+    return matches
+
 class Model(object):
     def __init__(self):
         self.config_file_name = os.path.join(mw.addonManager.addonsFolder(), "movies2anki", "config.ini")
@@ -484,8 +651,6 @@ class Model(object):
 
         self.encodings = ["utf-8", "cp1251"]
         self.sub_encoding = None
-        
-        self.p = None
 
         self.load_settings()
 
@@ -521,6 +686,23 @@ class Model(object):
         self.join_sentences_separator = "<br>"
         self.join_questions_with_answers = True
 
+        # 0 - use the number of CPU cores
+        self.max_ffmpeg_processes = 0
+
+        # snapshots further apart are extracted by separate ffmpeg passes
+        self.snapshot_max_gap = 60
+
+        # notes are added to the collection in chunks of this size
+        self.notes_chunk_size = 500
+
+        # update the notes imported before from the same video instead of adding new ones
+        self.is_update_existing_notes = False
+
+        # retime Subs 2 from a different release to match Subs 1 (requires NumPy)
+        self.is_align_subtitles = False
+        self.is_align_to_audio = False
+        self.is_snap_to_silence = False
+
     def load_settings(self):
         self.default_settings()
 
@@ -585,6 +767,11 @@ class Model(object):
         self.join_lines_separator = mcfg['join_lines_separator'].replace("_", " ")
         self.join_sentences_separator = mcfg['join_sentences_separator'].replace("_", " ")
         self.join_questions_with_answers = mcfg.getboolean('join_questions_with_answers')
+        self.max_ffmpeg_processes = mcfg.getint('max_ffmpeg_processes', fallback=0)
+        self.is_update_existing_notes = mcfg.getboolean('is_update_existing_notes', fallback=False)
+        self.is_align_subtitles = mcfg.getboolean('is_align_subtitles', fallback=False)
+        self.is_align_to_audio = mcfg.getboolean('is_align_to_audio', fallback=False)
+        self.is_snap_to_silence = mcfg.getboolean('is_snap_to_silence', fallback=False)
 
         value = [e.strip() for e in mcfg['recent_deck_names'].split(',')]
         if len(value) != 0:
@@ -644,6 +831,11 @@ class Model(object):
                             'join_lines_separator': self.join_lines_separator.replace(" ", "_"),
                             'join_sentences_separator': self.join_sentences_separator.replace(" ", "_"),
                             'join_questions_with_answers': str(self.join_questions_with_answers),
+                            'max_ffmpeg_processes': str(self.max_ffmpeg_processes),
+                            'is_update_existing_notes': str(self.is_update_existing_notes),
+                            'is_align_subtitles': str(self.is_align_subtitles),
+                            'is_align_to_audio': str(self.is_align_to_audio),
+                            'is_snap_to_silence': str(self.is_snap_to_silence),
                           # 'is_separate_fragments_without_subtitles': str(self.is_separate_fragments_without_subtitles),
                            'recent_deck_names': ",".join(reversed(self.recent_deck_names)) }
   
@@ -666,7 +858,7 @@ class Model(object):
 
     def load_subtitle(self, filename, is_ignore_SDH, join_lines_separator, join_sentences_separator):
         if len(filename) == 0:
-            return []
+            return SubtitleTrack()
         #if end with ass, first convert to srt,then process as below
         
         suffix = ".ass"
@@ -678,18 +870,8 @@ class Model(object):
             with open(filename, "w", encoding="utf-8") as fp:
                 fp.write(srt_str)
 
-        file_content = open(filename, 'r', encoding="utf-8").read()
-        if file_content[:3]=='\xef\xbb\xbf': # with bom
-            file_content = file_content[3:]
-
-        ## Оставляем только одну пустую строку между субтитрами
-        file_content = fix_empty_lines(file_content)
-
-        ## Конвертируем субтитры в Unicode
-        #file_content = self.convert_to_unicode(file_content)
-
-        ## Читаем субтитры
-        return read_subtitles(file_content, is_ignore_SDH, join_lines_separator, join_sentences_separator)
+        ## Читаем субтитры по одному, не загружая весь файл
+        return read_cues(srt.iter_file_cues(filename, is_ignore_SDH), is_ignore_SDH, join_lines_separator, join_sentences_separator)
 
     def encode_str(self, enc_str):
         if self.sub_encoding == None:
@@ -742,31 +924,62 @@ class Model(object):
         mw.col.models.addTemplate(model, t)
         mw.col.models.add(model)
 
-    def write_tsv_file(self, deck_name, en_subs, ru_subs, directory):
+    def create_default_model(self):
+        if not mw.col.models.byName(self.model_name):
+            if self.model_name.startswith("movies2anki - subs2srs"):
+                self.create_subs2srs_default_model()
+            else:
+                self.create_new_default_model()
+
+    def add_meaning_fields(self, num_tracks):
+        model = mw.col.models.byName(self.model_name)
+        field_names = mw.col.models.fieldNames(model)
+
+        for track in range(1, num_tracks):
+            if meaning_field(track) not in field_names:
+                mw.col.models.addField(model, mw.col.models.newField(meaning_field(track)))
+                # shown on the back of every card, under the rest of the answer
+                for t in model['tmpls']:
+                    if "{{%s}}" % meaning_field(track) not in t['afmt']:
+                        t['afmt'] += "\n{{#%s}}<div class='meaning'>{{%s}}</div>{{/%s}}" % ((meaning_field(track),) * 3)
+                mw.col.models.save(model)
+
+    def prepare_notes(self, en_subs, secondary_subs, existing_ids=None, existing_phrases=None):
         # prefix = format_filename(deck_name)
         prefix = format_filename(os.path.splitext(os.path.basename(self.video_file))[0])
         # filename = os.path.join(directory, prefix + ".tsv")
         
         # f_out = open(filename, 'w')
 
-        if not mw.col.models.byName(self.model_name):
-            if self.model_name.startswith("movies2anki - subs2srs"):
-                self.create_subs2srs_default_model()
-            else:
-                self.create_new_default_model()
+        if existing_phrases is not None:
+            matches = match_phrases(en_subs, existing_phrases)
+
+        starts_ms = timecode.seconds_to_ms([sub[0] for sub in en_subs])
+        ends_ms = timecode.seconds_to_ms([sub[1] for sub in en_subs])
 
         ffmpeg_split_timestamps = []
+        notes = []
+        note_updates = []
         for idx in range(len(en_subs)):
-            start_time = seconds_to_tsv_time(en_subs[idx][0])
-            end_time = seconds_to_tsv_time(en_subs[idx][1])
+            start_time = timecode.format_tsv(starts_ms[idx])
+            end_time = timecode.format_tsv(ends_ms[idx])
+
+            # the phrase was imported before, its clips too
+            if existing_ids is not None:
+                if any(key in existing_ids for key in note_id_keys(prefix, starts_ms[idx], ends_ms[idx])):
+                    continue
+                existing_ids.add((prefix, starts_ms[idx], ends_ms[idx]))
 
             en_sub = en_subs[idx][2]
             en_sub = re.sub('\n', ' ', en_sub)
             en_sub = escape_double_quotes(en_sub)
             
-            ru_sub = ru_subs[idx][2]
-            ru_sub = re.sub('\n', ' ', ru_sub)
-            ru_sub = escape_double_quotes(ru_sub)
+            ru_sub = []
+            for subs in secondary_subs:
+                sub = subs[idx][2]
+                sub = re.sub('\n', ' ', sub)
+                sub = escape_double_quotes(sub)
+                ru_sub.append(sub)
 
             tag = prefix
             sequence = str(idx + 1).zfill(3) + "_" + start_time
@@ -782,12 +995,7 @@ class Model(object):
                 sound = prefix + ".media/" + sound
                 video = prefix + ".media/" + video
 
-            # New Anki Card
-            model = mw.col.models.byName(self.model_name)
-            mw.col.models.setCurrent(model)
-
-            note = mw.col.newNote(forDeck=False)
-
+            note = {}
             note["Id"] = prefix + "_" + start_time + "-" + end_time
             note["Source"] = os.path.splitext(os.path.basename(self.video_file))[0]
             note["Path"] = self.video_file
@@ -795,30 +1003,33 @@ class Model(object):
             note["Audio"] = sound
             note["Video"] = video
             note["Expression"] = en_sub          
-            note["Meaning"] = ru_sub
+            for track, sub in enumerate(ru_sub):
+                note[meaning_field(track)] = sub
 
             snapshot_time_ffmpeg = None
             snapshot_time_filename = None
             if self.model_name.startswith("movies2anki - subs2srs"):
                 if self.model_name == "movies2anki - subs2srs (video)":
-                    snapshot_time_seconds = en_subs[idx][0]
+                    snapshot_time_ms = starts_ms[idx]
                 else:
-                    snapshot_time_seconds = en_subs[idx][0] + ((en_subs[idx][1] - en_subs[idx][0]) / 2.0)
-                snapshot_time_ffmpeg = seconds_to_ffmpeg_time(snapshot_time_seconds)
-                snapshot_time_filename = prefix + "_" + seconds_to_tsv_time(snapshot_time_seconds) + ".jpg"
+                    snapshot_time_ms = starts_ms[idx] + (ends_ms[idx] - starts_ms[idx]) // 2
+                snapshot_time_ffmpeg = timecode.format_ffmpeg(snapshot_time_ms)
+                snapshot_time_filename = prefix + "_" + timecode.format_tsv(snapshot_time_ms) + ".jpg"
                 note["Snapshot"] = '<img src="%s" />' % snapshot_time_filename
 
-            # ret = note.dupeOrEmpty()
-            # if ret == 2:
-            #     continue
-
-            did = mw.col.decks.id(self.deck_name)
-            note.model()['did'] = did
-
-            if mw.state is "deckBrowser":
-                mw.col.decks.select(did)
-
-            mw.col.addNote(note)
+            if existing_phrases is not None and matches[idx] is not None:
+                nid, nid_id = existing_phrases[matches[idx]][2:]
+                if parse_note_id(nid_id) in note_id_keys(prefix, starts_ms[idx], ends_ms[idx]):
+                    # same timings, the clips are still valid
+                    note_updates.append((nid, dict((name, note[name]) for name in ["Expression"] + [meaning_field(track) for track in range(len(ru_sub))])))
+                    continue
+
+                # the clips are cut again by "Generate Mobile Cards..."
+                note["Audio Sound"] = ""
+                note["Video Sound"] = ""
+                note_updates.append((nid, note))
+            else:
+                notes.append(note)
 
             # f_out.write(self.encode_str(tag + "\t" + sequence + "\t[sound:" + sound + "]\t[sound:" + video + "]\t"))
             # f_out.write(self.encode_str(en_sub))
@@ -826,23 +1037,23 @@ class Model(object):
             # f_out.write(self.encode_str(ru_sub))
             # f_out.write(self.encode_str('\n'))
             
+            # idx is the phrase of the clip, phrases imported before have no clips
             if self.model_name.startswith("movies2anki - subs2srs"):
                 ffmpeg_split_timestamps.append((prefix + "_" + start_time + "-" + end_time, 
-                    seconds_to_ffmpeg_time(en_subs[idx][0]), 
-                    seconds_to_ffmpeg_time(en_subs[idx][1]),
-                    snapshot_time_ffmpeg, snapshot_time_filename))
+                    timecode.format_ffmpeg(starts_ms[idx]), 
+                    timecode.format_ffmpeg(ends_ms[idx]),
+                    idx, snapshot_time_ffmpeg, snapshot_time_filename))
             else:
                 ffmpeg_split_timestamps.append((prefix + "_" + start_time + "-" + end_time, 
-                    seconds_to_ffmpeg_time(en_subs[idx][0]), 
-                    seconds_to_ffmpeg_time(en_subs[idx][1])))
-        
-        mw.reset()
+                    timecode.format_ffmpeg(starts_ms[idx]), 
+                    timecode.format_ffmpeg(ends_ms[idx]),
+                    idx))
 
         # f_out.close()
 
-        return ffmpeg_split_timestamps
+        return notes, note_updates, ffmpeg_split_timestamps
 
-    def create_subtitles(self):
+    def create_subtitles(self, is_decode_audio=True):
         # print "--------------------------"
         # print "Video file: %s" % self.video_file.encode('utf-8')
         # print "Audio id: %s" % self.audio_id
@@ -876,6 +1087,22 @@ class Model(object):
         # print "Encoding: %s" % self.sub_encoding 
         # print "English subtitles: %s" % len(en_subs)
 
+        # the preview runs on the GUI thread and only uses audio that was decoded before
+        envelope = None
+        self.is_envelope_skipped = False
+        if (self.is_align_to_audio or self.is_snap_to_silence) and align.is_available() and os.path.isfile(self.video_file):
+            if not is_decode_audio and not align.has_envelope(self.video_file, self.audio_id):
+                self.is_envelope_skipped = True
+            else:
+                envelope = align.read_envelope("ffmpeg", self.video_file, self.audio_id, **subprocess_args(False))
+
+        # Subs 1 shifted against the speech in the audio, Subs 2 get the same correction
+        self.audio_alignment = (1.0, 0.0)
+        if self.is_align_to_audio and envelope is not None:
+            self.audio_alignment = align.find_audio_alignment(envelope, en_subs)
+            if self.audio_alignment != (1.0, 0.0):
+                en_subs = SubtitleTrack(align.retime(en_subs, *self.audio_alignment))
+
         # Разбиваем субтитры на предложения
         self.en_subs_sentences = convert_into_sentences(en_subs, self.phrases_duration_limit, self.join_lines_that_end_with, self.join_questions_with_answers, self.join_sentences_separator, self.join_lines_separator)
         # print "English sentences: %s" % len(self.en_subs_sentences)
@@ -886,25 +1113,44 @@ class Model(object):
 
         # Загружаем русские субтитры в формате [(start_time, end_time, subtitle), (...), ...]
         # print "Loading Russian subtitles..."
-        ru_subs = self.load_subtitle(self.ru_srt, self.is_ignore_sdh_subtitle, self.join_lines_separator, self.join_sentences_separator)
+        # Subs 2 can be several tracks, each one goes to its own Meaning field
+        secondary_subs = [self.load_subtitle(ru_srt, self.is_ignore_sdh_subtitle, self.join_lines_separator, self.join_sentences_separator) for ru_srt in split_subtitle_files(self.ru_srt) or [""]]
         # print "Encoding: %s" % self.sub_encoding 
         # print "Russian subtitles: %s" % len(ru_subs)
 
+        if self.audio_alignment != (1.0, 0.0):
+            secondary_subs = [SubtitleTrack(align.retime(ru_subs, *self.audio_alignment)) for ru_subs in secondary_subs]
+
+        # Subs 2 shifted or running at a different speed
+        self.subtitle_alignments = []
+        if self.is_align_subtitles:
+            for track, ru_subs in enumerate(secondary_subs):
+                scale, shift = align.find_alignment(en_subs, ru_subs)
+                if (scale, shift) != (1.0, 0.0):
+                    secondary_subs[track] = SubtitleTrack(align.retime(ru_subs, scale, shift))
+                self.subtitle_alignments.append((scale, shift))
+
         # Для preview диалога
         self.num_en_subs = len(en_subs)
-        self.num_ru_subs = len(ru_subs)
+        self.num_ru_subs = ", ".join(str(len(ru_subs)) for ru_subs in secondary_subs)
         self.num_phrases = len(self.en_subs_phrases)
 
         # Синхронизируем русские субтитры с получившимися английскими субтитрами
         # print "Syncing Russian subtitles with English phrases..."
-        self.ru_subs_phrases = sync_subtitles(self.en_subs_phrases, ru_subs)
+        self.secondary_subs_phrases = sync_subtitle_tracks(self.en_subs_phrases, secondary_subs)
+        self.ru_subs_phrases = self.secondary_subs_phrases[0]
 
         # Добавляем смещения к каждой фразе
         # print "Adding Pad Timings between English phrases..."
         add_pad_timings_between_phrases(self.en_subs_phrases, self.shift_start, self.shift_end)
 
+        # clips start and end in a pause instead of cutting words
+        if self.is_snap_to_silence and envelope is not None:
+            snap_phrases_to_silence(self.en_subs_phrases, envelope, self.shift_start, self.shift_end)
+
         # print "Adding Pad Timings between Russian phrases..."
-        add_pad_timings_between_phrases(self.ru_subs_phrases, self.shift_start, self.shift_end)
+        for ru_subs_phrases in self.secondary_subs_phrases:
+            add_pad_timings_between_phrases(ru_subs_phrases, self.shift_start, self.shift_end)
 
         if self.mode == "Movie":
             # Меняем длительность фраз в английских субтитрах
@@ -914,7 +1160,8 @@ class Model(object):
 
             # Меняем длительность фраз в русских субтитрах
             # print "Changing duration Russian subtitles..."
-            change_subtitles_ending_time(self.ru_subs_phrases)
+            for ru_subs_phrases in self.secondary_subs_phrases:
+                change_subtitles_ending_time(ru_subs_phrases)
 
         self.is_subtitles_created = True
 
@@ -927,11 +1174,6 @@ class Model(object):
         # print "Writing Russian subtitles..."
         self.write_subtitles(self.out_ru_srt, self.ru_subs_phrases)
 
-    def create_tsv_file(self):
-        # Формируем tsv файл для импорта в Anki
-        # print "Writing tsv file..."
-        self.ffmpeg_split_timestamps.append(self.write_tsv_file(self.deck_name, self.en_subs_phrases, self.ru_subs_phrases, self.output_directory))
-
     def getTimeDelta(self):
         return self.time_delta
 
@@ -959,6 +1201,81 @@ class Model(object):
     def getMode(self):
         return self.mode
 
+class SubtitlesWorker(QThread):
+
+    updateProgress = pyqtSignal(int)
+    updateProgressText = pyqtSignal(str)
+    notesReady = pyqtSignal(str, list)
+    notesUpdated = pyqtSignal(list)
+    batchJobsFinished = pyqtSignal()
+    errorRaised = pyqtSignal(str)
+
+    def __init__(self, data, existing_ids, existing_phrases):
+        QThread.__init__(self)
+
+        self.model = data
+        self.existing_ids = existing_ids
+        self.existing_phrases = existing_phrases
+        self.canceled = False
+
+    def cancel(self):
+        self.canceled = True
+
+    def run(self):
+        try:
+            self.processJobs()
+        except Exception as ex:
+            # the progress dialog waits for a signal, the thread mustn't die silently
+            traceback.print_exc()
+            self.errorRaised.emit("Can't process the subtitles: %s" % ex)
+            self.canceled = True
+
+        if self.canceled and self.model.batch_mode:
+            self.batchJobsFinished.emit()
+
+    def processJobs(self):
+        if self.model.batch_mode:
+            jobs = self.model.jobs
+        else:
+            jobs = [(self.model.video_file, self.model.en_srt, self.model.ru_srt, self.model.deck_name)]
+
+        for idx, (video_file, en_srt, ru_srt, deck_name) in enumerate(jobs):
+            if self.canceled:
+                break
+
+            self.updateProgress.emit(int((idx * 1.0 / len(jobs)) * 100))
+            self.updateProgressText.emit("Processing subtitles... %s / %s" % (idx + 1, len(jobs)))
+
+            self.model.video_file = video_file
+            self.model.en_srt = en_srt
+            self.model.ru_srt = ru_srt
+            self.model.deck_name = deck_name
+
+            self.model.create_subtitles()
+
+            if not self.model.is_subtitles_created:
+                self.errorRaised.emit("Check log.txt")
+                self.canceled = True
+                break
+
+            if self.existing_phrases is not None:
+                source = os.path.splitext(os.path.basename(video_file))[0]
+                notes, note_updates, ffmpeg_split_timestamps = self.model.prepare_notes(self.model.en_subs_phrases, self.model.secondary_subs_phrases, existing_phrases=self.existing_phrases[source])
+            else:
+                notes, note_updates, ffmpeg_split_timestamps = self.model.prepare_notes(self.model.en_subs_phrases, self.model.secondary_subs_phrases, self.existing_ids[deck_name])
+            self.model.ffmpeg_split_timestamps.append(ffmpeg_split_timestamps)
+
+            for i in range(0, len(note_updates), self.model.notes_chunk_size):
+                if self.canceled:
+                    break
+                self.notesUpdated.emit(note_updates[i:i + self.model.notes_chunk_size])
+
+            # the collection is written to from the main thread
+            for i in range(0, len(notes), self.model.notes_chunk_size):
+                if self.canceled:
+                    break
+                self.notesReady.emit(deck_name, notes[i:i + self.model.notes_chunk_size])
+
 class VideoWorker(QThread):
 
     updateProgress = pyqtSignal(int)
@@ -973,17 +1290,85 @@ class VideoWorker(QThread):
 
         self.model = data
         self.canceled = False
+        self.pool = media.ProcessPool(self.model.max_ffmpeg_processes)
 
     def cancel(self):
-      self.canceled = True
+        self.canceled = True
+        self.pool.terminate()
+
+    def fileCompleted(self, returncode, num_files=1):
+        if self.canceled:
+            return
+
+        self.num_files_completed += num_files
+        self.updateProgress.emit(int((self.num_files_completed * 1.0 / self.num_files) * 100))
+        self.updateProgressText.emit("%s / %s" % (self.num_files_completed, self.num_files))
+
+    def snapshotsCompleted(self, tmp_dir, ss, groups, returncode):
+        if returncode == 0 and not self.canceled:
+            images = media.match_snapshots([f for f in os.listdir(tmp_dir) if f.endswith(".jpg")], [t - ss for t, filenames in groups])
+            for image, (t, filenames) in zip(images, groups):
+                if image is None:
+                    continue
+                for filename in filenames:
+                    shutil.copyfile(os.path.join(tmp_dir, image), journal.part_filename(filename))
+                    journal.commit_part(filename, True)
+                self.journal.mark_done(filenames)
+
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        self.fileCompleted(returncode, sum(len(filenames) for t, filenames in groups))
+
+    def extractSnapshots(self, video_file, snapshots):
+        # Every snapshot of a part of the video is selected from a single
+        # decoding pass, the parts are processed in parallel.
+        snapshots = [(t, os.path.join(mw.col.media.dir(), filename)) for t, filename in snapshots]
+
+        # snapshots finished before the previous run was interrupted
+        done = set(filename for t, filename in snapshots if self.journal.is_done(filename, self.media_index))
+        if len(done) != 0:
+            self.fileCompleted(0, len(done))
+            snapshots = [(t, filename) for t, filename in snapshots if filename not in done]
+
+        if len(snapshots) == 0:
+            return
+
+        self.journal.add([(filename, "snapshot", {"path": video_file, "time": t}) for t, filename in snapshots])
+
+        min_gap = 1.5 * media.frame_duration(media.probe_streams("ffprobe", video_file, **subprocess_args(False)))
+
+        groups = media.group_snapshots(snapshots, min_gap)
+        max_snapshots = max(1, -(-len(groups) // self.pool.max_processes))
+
+        segments = media.split_into_segments([(video_file, t, 0, filenames) for t, filenames in groups], max_snapshots, self.model.snapshot_max_gap)
+        for segment in segments:
+            if self.canceled:
+                break
+
+            times = [t for path, t, duration, filenames in segment]
+
+            # the input seek starts decoding from the keyframe before ss by itself
+            ss = max(0, times[0] - min_gap)
+
+            tmp_dir = tempfile.mkdtemp(prefix="snapshots", dir=media.cache_dir())
+            filter_script = os.path.join(tmp_dir, "filter.txt")
+            with open(filter_script, "w") as f:
+                f.write(media.snapshot_filter([t - ss for t in times], "scale=480:-2"))
+
+            cmd = " ".join(["ffmpeg", "-y", "-ss", str(ss), "-t", str(times[-1] - ss + 1), "-i", '"' + video_file + '"', "-loglevel", "quiet", "-filter_script:v", '"' + filter_script + '"', "-q:v", "2"] + media.snapshot_output_options() + ['"' + os.path.join(tmp_dir, "%d.jpg") + '"'])
+            callback = lambda returncode, tmp_dir=tmp_dir, ss=ss, segment=segment: self.snapshotsCompleted(tmp_dir, ss, [(t, filenames) for path, t, duration, filenames in segment], returncode)
+            self.pool.submit(cmd.encode(sys.getfilesystemencoding()), callback, shell=True, **subprocess_args())
 
     def run(self):
         self.video_resolution = str(self.model.video_width) + ":" + str(self.model.video_height)
 
         time_start = time.time()
 
-        num_files_completed = 0       
-        num_files = sum(len(files) for files in self.model.ffmpeg_split_timestamps)
+        self.journal = journal.JobJournal()
+        self.media_index = media.MediaIndex(mw.col.media.dir())
+
+        self.num_files_completed = 0
+        self.num_files = sum(len(files) for files in self.model.ffmpeg_split_timestamps)
         for idx in range(len(self.model.ffmpeg_split_timestamps)):
             if self.canceled:
                 break
@@ -1011,20 +1396,20 @@ class VideoWorker(QThread):
 
             prefix = format_filename(os.path.splitext(os.path.basename(self.model.video_file))[0])
             # prefix = format_filename(self.model.deck_name)
+
+            snapshots = []
             for i in range(len(ffmpeg_split_timestamps)):
                 if self.canceled:
                     break
 
                 chunk = ffmpeg_split_timestamps[i]
-                
-                self.updateProgress.emit((num_files_completed * 1.0 / num_files) * 100)
-                
+
                 filename = mw.col.media.dir() + os.sep + chunk[0]            
                 # filename = self.model.output_directory + os.sep + prefix + ".media" + os.sep + chunk[0]
                 ss = chunk[1]
                 to = chunk[2]
 
-                t = tsv_time_to_seconds(to) - tsv_time_to_seconds(ss)
+                t = timecode.to_seconds(timecode.parse(to) - timecode.parse(ss))
 
                 af_d = 0.25
                 af_st = 0
@@ -1032,12 +1417,11 @@ class VideoWorker(QThread):
                 af_params = "afade=t=in:st=%s:d=%s,afade=t=out:st=%s:d=%s" % (af_st, af_d, af_to, af_d)
 
                 # print ss
-                self.updateProgressText.emit(ss)
 
                 # clip subtitles
                 if self.model.is_write_output_subtitles_for_clips or self.model.is_create_clips_with_softsub or self.model.is_create_clips_with_hardsub:
                     with open(filename + ".srt", 'w') as f_sub:
-                        clip_subs = self.model.subs_with_line_timings[i]
+                        clip_subs = self.model.subs_with_line_timings[chunk[3]]
                         clip_sub_shift = tsv_time_to_seconds(ss)
 
                         for sub_id in range(len(clip_subs)):
@@ -1068,12 +1452,12 @@ class VideoWorker(QThread):
                     filename_suffix = ".sub"
 
                 if self.model.model_name.startswith("movies2anki - subs2srs"):
-                    snapshot_time = chunk[3]
-                    snapshot_filename = chunk[4]
+                    snapshot_time = chunk[4]
+                    snapshot_filename = chunk[5]
 
-                    cmd = " ".join(["ffmpeg", "-y", "-ss", snapshot_time, "-i", '"' + self.model.video_file + '"', "-loglevel", "quiet", "-vf", "scale=480:-2", "-vframes", "1", "-q:v", "2", '"' + snapshot_filename + '"'])
-                    self.model.p = Popen(cmd.encode(sys.getfilesystemencoding()), shell=True, **subprocess_args())
-                    self.model.p.wait()                    
+                    snapshots.append((tsv_time_to_seconds(snapshot_time), snapshot_filename))
+                else:
+                    self.fileCompleted(0)
 
                 # cmd = " ".join(["ffmpeg", "-ss", ss, "-i", '"' + self.model.video_file + '"', softsubs_options, "-strict", "-2", "-loglevel", "quiet", "-t", str(t), "-af", af_params, "-map", "0:v:0", "-map", "0:a:" + str(self.model.audio_id), softsubs_map, "-c:v", "libx264", "-vf", vf, "-profile:v", "baseline", "-level", "3.0", "-c:a", "aac", "-ac", "2", '"' + filename + filename_suffix + ".mp4" + '"'])
                 # print cmd.encode('utf-8')
@@ -1091,7 +1475,11 @@ class VideoWorker(QThread):
                 # self.model.p = Popen(cmd.encode(sys.getfilesystemencoding()), shell=True, **subprocess_args())
                 # self.model.p.wait()
 
-                num_files_completed += 1
+            if len(snapshots) != 0 and not self.canceled:
+                self.extractSnapshots(self.model.video_file, snapshots)
+
+        self.pool.wait()
+        self.journal.close()
 
         time_end = time.time()
         time_diff = (time_end - time_start)
@@ -1192,6 +1580,10 @@ class MainWindow(QDialog):
         self.endSpinBox.valueChanged.connect(self.setShiftEnd)
         self.movieRadioButton.toggled.connect(self.setMovieMode)
         self.phrasesRadioButton.toggled.connect(self.setPhrasesMode)
+        self.updateNotesCheckBox.toggled.connect(self.setUpdateExistingNotes)
+        self.alignSubsCheckBox.toggled.connect(self.setAlignSubtitles)
+        self.alignAudioCheckBox.toggled.connect(self.setAlignToAudio)
+        self.snapSilenceCheckBox.toggled.connect(self.setSnapToSilence)
 
         self.videoEdit.textChanged.connect(self.changeVideoFile)
         self.subsEngEdit.textChanged.connect(self.changeEngSubs)
@@ -1228,11 +1620,11 @@ class MainWindow(QDialog):
             self.directory = os.path.dirname(fname)
 
     def showSubsRusFileDialog(self):
-        fname = QFileDialog.getOpenFileName(directory = self.directory, filter = "Subtitle Files (*.srt *.ass)")[0]
-        self.subsRusEdit.setText(fname)
+        fnames = QFileDialog.getOpenFileNames(directory = self.directory, filter = "Subtitle Files (*.srt *.ass)")[0]
+        self.subsRusEdit.setText(os.pathsep.join(fnames))
 
-        if os.path.exists(fname):
-            self.directory = os.path.dirname(fname)
+        if len(fnames) != 0 and os.path.exists(fnames[0]):
+            self.directory = os.path.dirname(fnames[0])
 
     def showOutDirectoryDialog(self):
         fname = str(QFileDialog.getExistingDirectory(directory = self.model.output_directory))
@@ -1374,6 +1766,18 @@ class MainWindow(QDialog):
     def setSplitLongPhrases(self):
         self.model.is_split_long_phrases = self.splitLongPhrasesGroupBox.isChecked();
 
+    def setUpdateExistingNotes(self):
+        self.model.is_update_existing_notes = self.updateNotesCheckBox.isChecked()
+
+    def setAlignSubtitles(self):
+        self.model.is_align_subtitles = self.alignSubsCheckBox.isChecked()
+
+    def setAlignToAudio(self):
+        self.model.is_align_to_audio = self.alignAudioCheckBox.isChecked()
+
+    def setSnapToSilence(self):
+        self.model.is_snap_to_silence = self.snapSilenceCheckBox.isChecked()
+
     def setMovieMode(self):
         self.model.mode = "Movie"
 
@@ -1404,20 +1808,30 @@ class MainWindow(QDialog):
             # print "English subtitles didn't exist."
             return False
 
-        if len(self.model.ru_srt) != 0:
-            if "*" in self.model.ru_srt or "?" in self.model.ru_srt:
-                glob_results = find_glob_files(self.model.ru_srt)
+        ru_srt_files = []
+        for ru_srt in split_subtitle_files(self.model.ru_srt):
+            if len(ru_srt) == 0:
+                ru_srt_files.append(ru_srt)
+
+            elif "*" in ru_srt or "?" in ru_srt:
+                glob_results = find_glob_files(ru_srt)
 
                 if len(glob_results) == 0:
                     # print "Russian subtitles not found."
                     return
                 else:
-                    self.model.ru_srt = glob_results[0]  
+                    ru_srt_files.append(glob_results[0])
 
-            elif not os.path.isfile(self.model.ru_srt):
+            elif not os.path.isfile(ru_srt):
                 # print "Russian subtitles didn't exist."
                 return False
 
+            else:
+                ru_srt_files.append(ru_srt)
+
+        if len(self.model.ru_srt) != 0:
+            self.model.ru_srt = os.pathsep.join(ru_srt_files)
+
         return True
 
     def preview(self):
@@ -1428,7 +1842,7 @@ class MainWindow(QDialog):
             return
 
         # subtitles
-        self.model.create_subtitles()
+        self.model.create_subtitles(is_decode_audio=False)
 
         if not self.model.is_subtitles_created:
             self.showErrorDialog("Check log.txt")
@@ -1446,6 +1860,13 @@ class MainWindow(QDialog):
 Subs 2:  %s
 Phrases: %s
 The longest phrase: %s min. %s sec.""" % (self.model.num_en_subs, self.model.num_ru_subs, self.model.num_phrases, minutes, seconds)
+
+        if self.model.audio_alignment != (1.0, 0.0):
+            message += "\nSubs retimed to audio: %+.3f sec., speed %.4f" % (self.model.audio_alignment[1], self.model.audio_alignment[0])
+        if self.model.is_envelope_skipped:
+            message += "\nThe audio isn't decoded yet, it's matched when the cards are created."
+        for scale, shift in self.model.subtitle_alignments:
+            message += "\nSubs 2 retimed: %+.3f sec., speed %.4f" % (shift, scale)
         QMessageBox.information(self, "Preview", message)
 
         self.changeEngSubs()
@@ -1461,14 +1882,83 @@ The longest phrase: %s min. %s sec.""" % (self.model.num_en_subs, self.model.num
             self.startBatchMode()
 
     def create_tsv_files(self):
-        for video_file, en_srt, ru_srt, deck_name in self.model.jobs:
-            self.model.video_file = video_file
-            self.model.en_srt = en_srt
-            self.model.ru_srt = ru_srt
-            self.model.deck_name = deck_name
+        self.model.create_default_model()
+        self.added_deck_ids = []
 
-            self.model.create_subtitles()
-            self.model.create_tsv_file()
+        if self.model.batch_mode:
+            jobs = self.model.jobs
+        else:
+            jobs = [(self.model.video_file, self.model.en_srt, self.model.ru_srt, self.model.deck_name)]
+
+        self.model.add_meaning_fields(max(len(split_subtitle_files(job[2])) for job in jobs))
+
+        model = mw.col.models.byName(self.model.model_name)
+        if self.model.is_update_existing_notes:
+            # phrases imported before from the same video are updated
+            existing_ids = None
+            existing_phrases = find_existing_phrases(mw.col, model, set(os.path.splitext(os.path.basename(job[0]))[0] for job in jobs))
+        else:
+            # one query per deck, phrases imported before are skipped
+            existing_ids = dict((deck_name, find_existing_ids(mw.col, model, mw.col.decks.byName(deck_name))) for deck_name in set(job[3] for job in jobs))
+            existing_phrases = None
+
+        self.createProgressDialog()
+
+        self.worker = SubtitlesWorker(self.model, existing_ids, existing_phrases)
+        self.worker.updateProgress.connect(self.setProgress)
+        self.worker.updateProgressText.connect(self.setProgressText)
+        self.worker.notesReady.connect(self.addNotes)
+        self.worker.notesUpdated.connect(self.updateNotes)
+        # finished comes after run() returned, so the thread can be waited for and replaced
+        self.worker.finished.connect(self.finishSubtitles)
+        self.worker.batchJobsFinished.connect(self.revertModelChanges)
+        self.worker.errorRaised.connect(self.cancelSubtitles)
+
+        self.worker.start()
+
+    def addNotes(self, deck_name, notes):
+        # chunks queued before Cancel was pressed
+        if self.worker.canceled:
+            return
+
+        did = mw.col.decks.id(deck_name)
+        if did not in self.added_deck_ids:
+            self.added_deck_ids.append(did)
+
+        add_notes(mw.col, mw.col.models.byName(self.model.model_name), did, notes)
+        self.addSnapshotJobs(notes)
+
+    def updateNotes(self, note_updates):
+        if self.worker.canceled:
+            return
+
+        update_notes(mw.col, note_updates)
+        self.addSnapshotJobs([note for nid, note in note_updates])
+
+    def addSnapshotJobs(self, notes):
+        jobs = snapshot_jobs(mw.col.media.dir(), notes)
+        if len(jobs) != 0:
+            snapshots = journal.JobJournal()
+            snapshots.add(jobs)
+            snapshots.close()
+
+    def finishSubtitles(self):
+        self.worker.wait()
+        if self.worker.canceled:
+            return
+
+        if mw.state is "deckBrowser" and len(self.added_deck_ids) != 0:
+            mw.col.decks.select(self.added_deck_ids[-1])
+
+        mw.reset()
+
+        # video & audio files
+        self.convert_video()
+
+    def cancelSubtitles(self, message):
+        self.progressDialog.done(0)
+        mw.reset()
+        self.showErrorDialog(message)
 
     def check_directories(self):
         # for video_file, en_srt, ru_srt, deck_name in self.model.jobs:
@@ -1511,20 +2001,17 @@ The longest phrase: %s min. %s sec.""" % (self.model.num_en_subs, self.model.num
         
         video_files = find_glob_files(self.model.video_file)
         en_srt_files = find_glob_files(self.model.en_srt)
-        ru_srt_files = find_glob_files(self.model.ru_srt)
+        ru_srt_tracks = [find_glob_files(ru_srt) for ru_srt in split_subtitle_files(self.model.ru_srt)]
 
         if len(en_srt_files) != len(video_files):
             message = "The number of videos [%d] does not match the number of Subs 1 subtitles [%d]." % (len(video_files), len(en_srt_files))
             self.showErrorDialog(message)
             return
 
-        if len(ru_srt_files) < len(video_files):
-            max_len = max(len(ru_srt_files), len(video_files))
-            ru_srt_files = ru_srt_files + [""] * (max_len - len(ru_srt_files))
-
         for idx, video_file in enumerate(video_files):
             en_srt = en_srt_files[idx]
-            ru_srt = ru_srt_files[idx]
+            # a track with fewer files than videos is empty for the last videos, the others keep their fields
+            ru_srt = os.pathsep.join(ru_srt_files[idx] if idx < len(ru_srt_files) else "" for ru_srt_files in ru_srt_tracks)
 
             video_file = os.path.abspath(video_file)
 
@@ -1546,7 +2033,7 @@ The longest phrase: %s min. %s sec.""" % (self.model.num_en_subs, self.model.num
 
         if len(self.model.ru_srt) != 0:
             message = "\n".join("%s\n%s\n%s\n" % 
-                (os.path.basename(t[0]), os.path.basename(t[1]), os.path.basename(t[2])) for t in self.model.jobs)
+                (os.path.basename(t[0]), os.path.basename(t[1]), ", ".join(os.path.basename(f) for f in split_subtitle_files(t[2]))) for t in self.model.jobs)
         else:
             message = "\n".join("%s\n%s\n" % 
                 (os.path.basename(t[0]), os.path.basename(t[1])) for t in self.model.jobs)
@@ -1558,21 +2045,12 @@ The longest phrase: %s min. %s sec.""" % (self.model.num_en_subs, self.model.num
 
                 self.create_tsv_files()
 
-                self.convert_video()
-
     def startSingleMode(self):
         self.model.batch_mode = False
 
         if not self.validateSubtitles():
             return
 
-        # subtitles
-        self.model.create_subtitles()
-
-        if not self.model.is_subtitles_created:
-            self.showErrorDialog("Check log.txt")
-            return
-
         # tsv file
         if len(self.model.deck_name) == 0:
             self.showErrorDialog("Deck can't be empty.")
@@ -1591,8 +2069,6 @@ The longest phrase: %s min. %s sec.""" % (self.model.num_en_subs, self.model.num
             self.showErrorDialog("Video file name can't be empty.")
             return
 
-        self.model.create_tsv_file()
-
         if not os.path.isfile(self.model.video_file):
             self.showErrorDialog("Video file didn't exist.")
             return
@@ -1614,8 +2090,8 @@ The longest phrase: %s min. %s sec.""" % (self.model.num_en_subs, self.model.num
         #     self.showErrorDialog("Can't create or clean media directory. Try again in a few seconds.")
         #     return
 
-        # video & audio files
-        self.convert_video()
+        # subtitles, notes and then video & audio files
+        self.create_tsv_files()
 
     def setProgress(self, progress):
         self.progressDialog.setValue(progress)
@@ -1655,13 +2131,14 @@ The longest phrase: %s min. %s sec.""" % (self.model.num_en_subs, self.model.num
 
     def cancelProgressDialog(self):
         self.worker.cancel()
-        if self.model.p != None:
-            self.model.p.terminate()
+        if isinstance(self.worker, SubtitlesWorker):
+            # notes added before Cancel
+            mw.reset()
 
     def displayErrorMessage(self, message):
         self.showErrorDialog(message)
 
-    def convert_video(self):
+    def createProgressDialog(self):
         self.progressDialog = QProgressDialog(self)
 
         self.progressDialog.setWindowTitle("Generating Cards...")
@@ -1673,6 +2150,12 @@ The longest phrase: %s min. %s sec.""" % (self.model.num_en_subs, self.model.num
         progress_bar.setAlignment(Qt.AlignCenter)
         self.progressDialog.setBar(progress_bar)
 
+        self.progressDialog.canceled.connect(self.cancelProgressDialog)
+        self.progressDialog.setFixedSize(300, self.progressDialog.height())
+        self.progressDialog.setWindowModality(Qt.WindowModal)
+        self.progressDialog.show()
+
+    def convert_video(self):
         self.worker = VideoWorker(self.model)
         self.worker.updateProgress.connect(self.setProgress)
         self.worker.updateProgressWindowTitle.connect(self.setProgressWindowTitle)
@@ -1681,12 +2164,19 @@ The longest phrase: %s min. %s sec.""" % (self.model.num_en_subs, self.model.num
         self.worker.batchJobsFinished.connect(self.revertModelChanges)
         self.worker.errorRaised.connect(self.displayErrorMessage)
 
-        self.progressDialog.canceled.connect(self.cancelProgressDialog)
-        self.progressDialog.setFixedSize(300, self.progressDialog.height())
-        self.progressDialog.setWindowModality(Qt.WindowModal)
-
         self.worker.start()
         
+    def createNumPyCheckBox(self, text, is_checked, tooltip):
+        # the option is off and disabled without NumPy
+        checkBox = QCheckBox(text)
+        checkBox.setChecked(is_checked and align.is_available())
+        if align.is_available():
+            checkBox.setToolTip(tooltip)
+        else:
+            checkBox.setEnabled(False)
+            checkBox.setToolTip("Requires NumPy.")
+        return checkBox
+
     def createFilesGroup(self):
         groupBox = QGroupBox("Files:")
 
@@ -1706,18 +2196,24 @@ The longest phrase: %s min. %s sec.""" % (self.model.num_en_subs, self.model.num
         self.subsEngButton = QPushButton("Subs 1...")
         self.subsEngEdit = QLineEdit()
 
+        self.alignAudioCheckBox = self.createNumPyCheckBox("Sync to audio", self.model.is_align_to_audio, "Fix the offset and speed of the subtitles against the speech in the audio.")
+
         hbox = QHBoxLayout()
         hbox.addWidget(self.subsEngButton)
         hbox.addWidget(self.subsEngEdit)
+        hbox.addWidget(self.alignAudioCheckBox)
 
         vbox.addLayout(hbox)
 
         self.subsRusButton = QPushButton("Subs 2...")
         self.subsRusEdit = QLineEdit()
 
+        self.alignSubsCheckBox = self.createNumPyCheckBox("Auto-align", self.model.is_align_subtitles, "Fix the offset and speed of Subs 2 from a different release.")
+
         hbox = QHBoxLayout()
         hbox.addWidget(self.subsRusButton)
         hbox.addWidget(self.subsRusEdit)
+        hbox.addWidget(self.alignSubsCheckBox)
 
         vbox.addLayout(hbox)
 
@@ -1800,6 +2296,10 @@ The longest phrase: %s min. %s sec.""" % (self.model.num_en_subs, self.model.num
 
         layout.addRow(QLabel("End:"), hbox)
 
+        self.snapSilenceCheckBox = self.createNumPyCheckBox("Snap to silence", self.model.is_snap_to_silence, "Move the start and the end of every clip to the nearest pause in the audio.")
+
+        layout.addRow(self.snapSilenceCheckBox)
+
         groupBox.setLayout(layout)
         groupBox.setMinimumWidth(140)
 
@@ -1923,8 +2423,13 @@ The longest phrase: %s min. %s sec.""" % (self.model.num_en_subs, self.model.num
         self.deckComboBox.clearEditText()
         self.deckComboBox.setInsertPolicy(QComboBox.NoInsert)
         
+        self.updateNotesCheckBox = QCheckBox("Update existing notes")
+        self.updateNotesCheckBox.setToolTip("Update the text and timings of the notes imported before from the same video.\nOnly the clips of phrases with new timings are cut again.")
+        self.updateNotesCheckBox.setChecked(self.model.is_update_existing_notes)
+
         hbox = QHBoxLayout()
         hbox.addWidget(self.deckComboBox)
+        hbox.addWidget(self.updateNotesCheckBox)
 
         deckGroupBox.setLayout(hbox)
 
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+"""NumPy versions of the phrase grouping and timing stages, with the same output as the Python ones."""
+
+import sys
+
+from array import array
+
+from .track import SubtitleTrack, TrackGroups
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# set to False to run the Python versions, e.g. to compare them in bench.py
+USE_NUMPY = True
+
+def is_enabled():
+    return np is not None and USE_NUMPY
+
+def times(values):
+    # a float64 view of an array('d'), writes go to the array, which can't grow while the view is alive
+    return np.frombuffer(values, dtype=np.float64)
+
+def to_array(a):
+    return array("d", np.ascontiguousarray(a, dtype=np.float64).tobytes())
+
+def group_lines(starts, ends, time_delta):
+    """True where a line starts a new phrase: it isn't within time_delta of the previous line."""
+    breaks = np.ones(len(starts), dtype=bool)
+    if time_delta > 0:
+        breaks[1:] = ~(starts[1:] - ends[:-1] < time_delta)
+    return breaks
+
+def split_groups(starts, ends, breaks, phrases_duration_limit):
+    """(order, breaks) of the lines after split_long_phrases(), None where it would raise or wrap an index."""
+    firsts = np.flatnonzero(breaks)
+    lasts = np.append(firsts[1:], len(starts)) - 1
+    group = np.cumsum(breaks) - 1
+
+    group_start = starts[firsts]
+    duration = ends[lasts] - group_start
+    is_long = duration > phrases_duration_limit
+    if not is_long.any():
+        return np.arange(len(starts)), breaks
+
+    num_chunks = np.where(is_long, np.trunc(duration / phrases_duration_limit) + 1, 1).astype(np.int64)
+    chunk_limit = (duration + 1) / num_chunks
+    pos = np.trunc((ends - group_start[group]) / chunk_limit[group]).astype(np.int64)
+    pos[~is_long[group]] = 0
+    if (pos < 0).any() or (pos >= num_chunks[group]).any():
+        return None
+
+    # lines keep their order inside a chunk, empty chunks disappear
+    order = np.lexsort((pos, group))
+    key_group, key_pos = group[order], pos[order]
+    new_breaks = np.ones(len(order), dtype=bool)
+    new_breaks[1:] = (key_group[1:] != key_group[:-1]) | (key_pos[1:] != key_pos[:-1])
+    return order, new_breaks
+
+def convert_into_phrases(en_subs, time_delta, phrases_duration_limit, is_split_long_phrases, join_sentences_separator):
+    """(phrases, subs_with_line_timings, duration_longest_phrase) or None if the Python version has to run."""
+    if not isinstance(en_subs, SubtitleTrack):
+        return None
+    if len(en_subs) == 0:
+        return SubtitleTrack(), TrackGroups(), 0
+    if is_split_long_phrases and phrases_duration_limit <= 0:
+        return None
+
+    starts = times(en_subs.starts)
+    ends = times(en_subs.ends)
+    breaks = group_lines(starts, ends, time_delta)
+    order = np.arange(len(starts))
+    if is_split_long_phrases:
+        split = split_groups(starts, ends, breaks, phrases_duration_limit)
+        if split is None:
+            return None
+        order, breaks = split
+
+    texts = en_subs.texts
+    lines = SubtitleTrack()
+    lines.starts = to_array(starts[order])
+    lines.ends = to_array(ends[order])
+    lines.texts = [texts[idx] for idx in order.tolist()]
+
+    firsts = np.flatnonzero(breaks)
+    lasts = np.append(firsts[1:], len(order)) - 1
+    bounds = np.append(firsts, len(order)).tolist()
+    subs_with_line_timings = TrackGroups.from_track(lines, array("q", bounds))
+
+    line_texts = lines.texts
+    phrases = SubtitleTrack()
+    phrases.starts = to_array(starts[order][firsts])
+    phrases.ends = to_array(ends[order][lasts])
+    phrases.texts = [sys.intern(join_sentences_separator.join(line_texts[bounds[idx]:bounds[idx + 1]]).strip()) for idx in range(len(firsts))]
+
+    duration = times(phrases.ends) - times(phrases.starts)
+    longest = duration.max()
+    duration_longest_phrase = int(longest) if longest > 0 else 0
+
+    return phrases, subs_with_line_timings, duration_longest_phrase
+
+def shift(subs, start_delta, end_delta):
+    starts = times(subs.starts)
+    starts += start_delta
+    ends = times(subs.ends)
+    ends += end_delta
+
+def extend_endings(subs):
+    # the end of every subtitle moves to the start of the next one if there is a gap
+    starts = times(subs.starts)
+    ends = times(subs.ends)
+    ends[:-1] = np.where(ends[:-1] < starts[1:], starts[1:], ends[:-1])
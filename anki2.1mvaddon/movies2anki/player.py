@@ -6,12 +6,13 @@
 # Original Source: https://github.com/ospalh/anki-addons/blob/develop/png_play_button.py
 #
 
-import subprocess, sys, time, re, atexit
+import subprocess, os, sys, time, re, atexit
 from PyQt5.QtWidgets import *
 import anki.sound as s
 
 from anki.lang import _, ngettext
 from anki.hooks import addHook, wrap
+from anki.utils import splitFields
 from aqt.reviewer import Reviewer
 from aqt import mw, browser
 from aqt.utils import showWarning, showInfo, tooltip, isWin, isMac
@@ -19,12 +20,30 @@ from aqt.qt import *
 from PyQt5.QtGui import QIcon
 from distutils.spawn import find_executable
 
+from . import journal
+from . import media
+from . import timecode
+
 # ------------- ADDITIONAL OPTIONS -------------
 ADJUST_AUDIO_STEP = 0.25
 ADJUST_AUDIO_REPLAY_TIME = 2.5
 VLC_DIR = ""
 IINA_DIR = "/Applications/IINA.app/Contents/MacOS/IINA"
 #IINA_DIR = "/Applications/IINA.app/Contents/MacOS/iina-cli --keep-running --stdin"
+MAX_FFMPEG_PROCESSES = 0 # 0 - use the number of CPU cores
+SEGMENT_CLIPS = True # cut neighbouring clips of a video with one ffmpeg process
+SEGMENT_CLIPS_PER_PROCESS = 50
+SEGMENT_MAX_GAP = 30 # seconds
+AUDIO_CACHE = True # decode the audio track of a video once and cut all audio clips from it
+AUDIO_CACHE_MIN_CLIPS = 10 # don't decode the whole track for a few clips
+AUDIO_CACHE_MAX_SIZE = 20 # GB
+STREAM_COPY = True # don't re-encode clips if the source codecs allow it (audio clips without fades)
+STREAM_COPY_MAX_WIDTH = 480 # px, the width of re-encoded clips
+STREAM_COPY_MAX_LEVEL = 30 # H.264 level 3.0 of re-encoded clips
+KEYFRAME_TOLERANCE = 0.1 # seconds
+NOTE_SCAN_BATCH_SIZE = 5000
+NOTE_UPDATE_BATCH_SIZE = 200 # save completed notes in batches of this many updates
+NOTE_UPDATE_INTERVAL = 5 # or at least every this many seconds
 # ----------------------------------------------
 
 info = None
@@ -37,16 +56,15 @@ p = None
 
 mpv_executable = find_executable("mpv")
 ffmpeg_executable = find_executable("ffmpeg")
+ffprobe_executable = find_executable("ffprobe")
 
 def timeToSeconds(t):
-    hours, minutes, seconds, milliseconds = t.split('.')
-    return int(hours) * 3600 + int(minutes) * 60 + int(seconds) + int(milliseconds) * 0.001
+    return timecode.to_seconds(timecode.parse(t))
 
 def secondsToTime(seconds, sep="."):
-    ms = (seconds * 1000) % 1000
-    m, s = divmod(seconds, 60)
-    h, m = divmod(m, 60)
-    return "%d%s%02d%s%02d.%03d" % (h, sep, m, sep, s, ms)
+    if sep == ":":
+        return timecode.format_ffmpeg(timecode.to_ms(seconds))
+    return timecode.format_tsv(timecode.to_ms(seconds))
 
 def playVideoClip(path=None, state=None, shift=None, isEnd=True, isPrev=False, isNext=False):
     global p, _player
@@ -60,7 +78,7 @@ def playVideoClip(path=None, state=None, shift=None, isEnd=True, isPrev=False, i
             path = fields["Audio"]
         else:
             path = fields["Video"]
-    elif path.endswith(".mp3"): # workaround to fix replay button (R) without refreshing webview.
+    elif path.endswith((".mp3", ".m4a")): # workaround to fix replay button (R) without refreshing webview.
         path = fields["Audio"]
     else:
         path = fields["Video"]
@@ -166,7 +184,7 @@ def playVideoClip(path=None, state=None, shift=None, isEnd=True, isPrev=False, i
         else:
             args += ["--start={}".format(time_end - ADJUST_AUDIO_REPLAY_TIME), "--end={}".format(time_end)]
 
-    if (path.endswith(".mp3") and not isPrev and not isNext) or state != None:
+    if (path.endswith((".mp3", ".m4a")) and not isPrev and not isNext) or state != None:
         if VLC_DIR:
             args += ["--no-video"]
         else:
@@ -436,71 +454,262 @@ addHook("reviewStateShortcuts", _addShortcuts)
 class MediaWorker(QThread):
     updateProgress = pyqtSignal(int)
     updateProgressText = pyqtSignal(str)
-    updateNote = pyqtSignal(str, str, str)
+    updateNotes = pyqtSignal(list)
     jobFinished = pyqtSignal(float)
 
-    def __init__(self, data):
+    def __init__(self, data, media_index):
         QThread.__init__(self)
 
         self.data = data
+        self.media_index = media_index
         self.canceled = False
-        self.fp = None
+        self.pool = media.ProcessPool(MAX_FFMPEG_PROCESSES)
+        self.keyframe_indexes = {}
+        self.note_updates = []
+        self.note_updates_time = time.time()
 
     def cancel(self):
         self.canceled = True
+        self.pool.terminate()
 
-        if self.fp != None:
-            self.fp.terminate()
+    def filesCompleted(self, clips, returncode, written=True):
+        if written:
+            for clip in clips:
+                journal.commit_part(clip[3], returncode == 0 and not self.canceled)
 
-    def run(self):
-        job_start = time.time()
-        for idx, note in enumerate(self.data):
+        if self.canceled:
+            return
+
+        self.num_files_completed += len(clips)
+
+        if returncode == 0:
+            self.journal.mark_done([clip[3] for clip in clips])
+
+            self.note_updates += [(nid, fld, filename) for path, time_start, t, filename, nid, fld in clips if nid is not None]
+            if len(self.note_updates) >= NOTE_UPDATE_BATCH_SIZE or time.time() - self.note_updates_time >= NOTE_UPDATE_INTERVAL:
+                self.flushNoteUpdates()
+
+        self.updateProgress.emit(int((self.num_files_completed * 1.0 / self.num_files) * 100))
+        self.updateProgressText.emit("%s / %s" % (self.num_files_completed, self.num_files))
+
+    def flushNoteUpdates(self):
+        if len(self.note_updates) != 0:
+            self.updateNotes.emit(self.note_updates)
+
+        self.note_updates = []
+        self.note_updates_time = time.time()
+
+    def fadeParams(self, t):
+        af_d = 0.25
+        af_st = 0
+        af_to = t - af_d
+        return "afade=t=in:st=%s:d=%s,afade=t=out:st=%s:d=%s" % (af_st, af_d, af_to, af_d)
+
+    def audioMap(self, path):
+        if media.is_audio_cache(path):
+            return "0:a:0"
+        return "0:a:" + str(self.audio_id)
+
+    def inputOptions(self, path):
+        if media.is_audio_cache(path):
+            return media.pcm_options()
+        return []
+
+    def audioCacheCompleted(self, tmp_path, cache_path, returncode):
+        if returncode == 0 and not self.canceled:
+            os.replace(tmp_path, cache_path)
+        elif os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    def useAudioCache(self, clips):
+        num_audio_clips = {}
+        for path, time_start, t, filename, nid, fld in clips:
+            if fld == "Audio Sound" and os.path.isfile(path):
+                num_audio_clips[path] = num_audio_clips.get(path, 0) + 1
+
+        media.prune_cache(AUDIO_CACHE_MAX_SIZE * 1024 ** 3, ".pcm")
+
+        cache = {}
+        for path, num_clips in num_audio_clips.items():
             if self.canceled:
                 break
 
-            self.updateProgress.emit((idx * 1.0 / len(self.data)) * 100)
+            cache_path = media.audio_cache_path(path, self.audio_id)
+            cache[path] = cache_path
+
+            if os.path.exists(cache_path) or num_clips < AUDIO_CACHE_MIN_CLIPS:
+                continue
+
+            self.updateProgressText.emit("Decoding audio: " + os.path.basename(path))
+
+            tmp_path = cache_path + ".tmp"
+            cmd = " ".join([ffmpeg_executable, "-y", "-i", '"' + path + '"', "-loglevel", "quiet", "-map", "0:a:" + str(self.audio_id), "-vn"] + media.pad_start_options() + media.pcm_options() + ['"' + tmp_path + '"'])
+            callback = lambda returncode, tmp_path=tmp_path, cache_path=cache_path: self.audioCacheCompleted(tmp_path, cache_path, returncode)
+            self.pool.submit(cmd.encode(sys.getfilesystemencoding()), callback, shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE, startupinfo = info)
+
+        self.pool.wait()
+
+        ret = []
+        for clip in clips:
+            path, fld = clip[0], clip[5]
+            if fld == "Audio Sound" and path in cache and os.path.exists(cache[path]):
+                clip = (cache[path],) + clip[1:]
+            ret.append(clip)
+
+        return ret
+
+    def keyframeIndex(self, path):
+        if path not in self.keyframe_indexes:
+            self.updateProgressText.emit("Indexing keyframes: " + os.path.basename(path))
+            self.keyframe_indexes[path] = media.build_keyframe_index(ffprobe_executable, path, startupinfo = info)
+        return self.keyframe_indexes[path]
+
+    def streamCopyJobs(self, clips):
+        streams = {}
+        jobs = []
+        ret = []
+        for clip in clips:
+            path, time_start, t, filename, nid, fld = clip
+
+            if path not in streams:
+                streams[path] = media.probe_streams(ffprobe_executable, path, startupinfo = info)
+
+            ss = secondsToTime(time_start, sep=":")
+
+            if fld == "Audio Sound":
+                ext = media.audio_copy_extension(streams[path], self.audio_id)
+                if ext:
+                    clip = (path, time_start, t, os.path.splitext(filename)[0] + ext, nid, fld)
+                    filename = clip[3]
+                    if self.journal.is_done(filename, self.media_index):
+                        self.filesCompleted([clip], 0, written=False)
+                        continue
+
+                    cmd = [ffmpeg_executable, "-y", "-ss", ss, "-i", '"' + path + '"', "-loglevel", "quiet", "-t", str(t), "-map", "0:a:" + str(self.audio_id), "-vn", "-c:a", "copy", '"' + journal.part_filename(filename) + '"']
+                    jobs.append((" ".join(cmd), [clip]))
+                    continue
+            elif media.can_copy_video(streams[path], STREAM_COPY_MAX_WIDTH, STREAM_COPY_MAX_LEVEL) and self.keyframeIndex(path) is not None:
+                keyframe = self.keyframeIndex(path).preceding(time_start, KEYFRAME_TOLERANCE)
+                if keyframe is not None:
+                    # start the clip on the keyframe, keep its end
+                    t = time_start + t - keyframe
+                    ss = secondsToTime(keyframe, sep=":")
+                    cmd = [ffmpeg_executable, "-y", "-ss", ss, "-i", '"' + path + '"', "-strict", "-2", "-loglevel", "quiet", "-t", str(t), "-af", self.fadeParams(t), "-map", "0:v:0", "-map", "0:a:" + str(self.audio_id), "-c:v", "copy", "-c:a", "aac", "-ac", "2", '"' + journal.part_filename(filename) + '"']
+                    jobs.append((" ".join(cmd), [clip]))
+                    continue
+
+            ret.append(clip)
+
+        return (ret, jobs)
+
+    def snapshotCommand(self, clip):
+        path, time_start, t, filename, nid, fld = clip
+        cmd = [ffmpeg_executable, "-y", "-ss", secondsToTime(time_start, sep=":"), "-i", '"' + path + '"', "-loglevel", "quiet", "-vf", "scale=480:-2", "-vframes", "1", "-q:v", "2", '"' + journal.part_filename(filename) + '"']
+        return " ".join(cmd)
+
+    def clipCommand(self, clip):
+        path, time_start, t, filename, nid, fld = clip
+
+        ss = secondsToTime(time_start, sep=":")
+        af_params = self.fadeParams(t)
+
+        if fld == "Audio Sound":
+            cmd = [ffmpeg_executable, "-y"] + self.inputOptions(path) + ["-ss", ss, "-i", '"' + path + '"', "-loglevel", "quiet", "-t", str(t), "-af", af_params, "-map", self.audioMap(path), '"' + journal.part_filename(filename) + '"']
+        else:
+            cmd = [ffmpeg_executable, "-y", "-ss", ss, "-i", '"' + path + '"', "-strict", "-2", "-loglevel", "quiet", "-t", str(t), "-af", af_params, "-map", "0:v:0", "-map", "0:a:" + str(self.audio_id), "-c:v", "libx264", "-vf", self.vf, "-profile:v", "baseline", "-level", "3.0", "-c:a", "aac", "-ac", "2", '"' + journal.part_filename(filename) + '"']
+
+        return " ".join(cmd)
+
+    def segmentCommand(self, clips):
+        # The input is opened and decoded once, every clip is a separate
+        # output cut from the decoded stream with the trim filters.
+        path = clips[0][0]
+        segment_start = clips[0][1]
+        segment_end = max(time_start + t for path, time_start, t, filename, nid, fld in clips)
 
+        cmd = [ffmpeg_executable, "-y"] + self.inputOptions(path) + ["-ss", secondsToTime(segment_start, sep=":"), "-t", str(segment_end - segment_start + 1), "-i", '"' + path + '"', "-strict", "-2", "-loglevel", "quiet"]
+        for path, time_start, t, filename, nid, fld in clips:
+            trim = "start=%s:duration=%s" % (time_start - segment_start, t)
+            af_params = "atrim=%s,asetpts=PTS-STARTPTS,%s" % (trim, self.fadeParams(t))
+
+            if fld == "Audio Sound":
+                cmd += ["-af", af_params, "-map", self.audioMap(path), '"' + journal.part_filename(filename) + '"']
+            else:
+                vf = "trim=%s,setpts=PTS-STARTPTS,%s" % (trim, self.vf)
+                cmd += ["-af", af_params, "-map", "0:v:0", "-map", "0:a:" + str(self.audio_id), "-c:v", "libx264", "-vf", vf, "-profile:v", "baseline", "-level", "3.0", "-c:a", "aac", "-ac", "2", '"' + journal.part_filename(filename) + '"']
+
+        return " ".join(cmd)
+
+    def run(self):
+        job_start = time.time()
+
+        self.journal = journal.JobJournal()
+
+        # TODO select the last stream by default
+        self.audio_id = 0
+
+        # TODO
+        self.vf = "scale=480:-2"
+
+        clips = []
+        for note in self.data:
             fld = note["Audio"]
 
             time_start, time_end = re.match(r"^.*?_(\d+\.\d\d\.\d\d\.\d+)-(\d+\.\d\d\.\d\d\.\d+).*$", fld).groups()
 
-            ss = secondsToTime(timeToSeconds(time_start), sep=":")
-            t = timeToSeconds(time_end) - timeToSeconds(time_start)
+            time_start, time_end = timecode.parse(time_start), timecode.parse(time_end)
+            t = timecode.to_seconds(time_end - time_start)
+            time_start = timecode.to_seconds(time_start)
 
-            af_d = 0.25
-            af_st = 0
-            af_to = t - af_d
-            af_params = "afade=t=in:st=%s:d=%s,afade=t=out:st=%s:d=%s" % (af_st, af_d, af_to, af_d)
+            if note["Audio Sound"] == "" or not self.media_index.exists(note["Audio"]):
+                clips.append((note["Path"], time_start, t, note["Audio"], str(note.id), "Audio Sound"))
 
-            # TODO select the last stream by default
-            audio_id = 0
+            if "Video Sound" in note and (note["Video Sound"] == "" or not self.media_index.exists(note["Video"])):
+                clips.append((note["Path"], time_start, t, note["Video"], str(note.id), "Video Sound"))
 
-            # TODO
-            vf = "scale=480:-2"
+        # snapshots of an interrupted "Generate Video Cards..." run
+        snapshots = [(args["path"], args["time"], 0, filename, None, None) for filename, args in self.journal.pending("snapshot") if not self.media_index.exists(filename)]
 
-            self.updateProgressText.emit(note["Source"] + "  " + ss)
+        self.num_files = len(clips) + len(snapshots)
+        self.num_files_completed = 0
 
-            if note["Audio Sound"] == "" or not os.path.exists(note["Audio"]):
-                self.fp = None
-                cmd = " ".join([ffmpeg_executable, "-y", "-ss", ss, "-i", '"' + note["Path"] + '"', "-loglevel", "quiet", "-t", str(t), "-af", af_params, "-map", "0:a:" + str(audio_id), '"' + note["Audio"] + '"'])
-                self.fp = subprocess.Popen(cmd.encode(sys.getfilesystemencoding()), shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE, startupinfo = info)
-                self.fp.wait()
+        # clips finished before the previous run was interrupted
+        done = [clip for clip in clips if self.journal.is_done(clip[3], self.media_index)]
+        if len(done) != 0:
+            self.filesCompleted(done, 0, written=False)
+            done_filenames = set(clip[3] for clip in done)
+            clips = [clip for clip in clips if clip[3] not in done_filenames]
 
-                if self.canceled:
-                    break
+        copy_jobs = []
+        if STREAM_COPY and ffprobe_executable:
+            clips, copy_jobs = self.streamCopyJobs(clips)
 
-                self.updateNote.emit(str(note.id), "Audio Sound", note["Audio"])
+        # recorded under the names the stream copy gives them
+        copy_clips = [clip for cmd, segment in copy_jobs for clip in segment]
+        self.journal.add([(clip[3], "clip", {"path": clip[0], "time": clip[1]}) for clip in clips + copy_clips])
 
-            if "Video Sound" in note and (note["Video Sound"] == "" or not os.path.exists(note["Video"])):
-                self.fp = None
-                cmd = " ".join([ffmpeg_executable, "-y", "-ss", ss, "-i", '"' + note["Path"] + '"', "-strict", "-2", "-loglevel", "quiet", "-t", str(t), "-af", af_params, "-map", "0:v:0", "-map", "0:a:" + str(audio_id), "-c:v", "libx264", "-vf", vf, "-profile:v", "baseline", "-level", "3.0", "-c:a", "aac", "-ac", "2", '"' + note["Video"] + '"'])
-                self.fp = subprocess.Popen(cmd.encode(sys.getfilesystemencoding()), shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE, startupinfo = info)
-                self.fp.wait()
+        jobs = [(self.snapshotCommand(clip), [clip]) for clip in snapshots] + copy_jobs
 
-                if self.canceled:
-                    break
+        if AUDIO_CACHE:
+            clips = self.useAudioCache(clips)
 
-                self.updateNote.emit(str(note.id), "Video Sound", note["Video"])
+        if SEGMENT_CLIPS:
+            jobs += [(self.segmentCommand(segment), segment) for segment in media.split_into_segments(clips, SEGMENT_CLIPS_PER_PROCESS, SEGMENT_MAX_GAP)]
+        else:
+            jobs += [(self.clipCommand(clip), [clip]) for clip in clips]
+
+        for cmd, segment in jobs:
+            if self.canceled:
+                break
+
+            callback = lambda returncode, segment=segment: self.filesCompleted(segment, returncode)
+            self.pool.submit(cmd.encode(sys.getfilesystemencoding()), callback, shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE, startupinfo = info)
+
+        self.pool.wait()
+        self.journal.close()
+
+        # saves the clips completed before Cancel too
+        self.flushNoteUpdates()
 
         job_end = time.time()
         time_diff = (job_end - job_start)
@@ -518,10 +727,20 @@ def setProgress(progress):
 def setProgressText(text):
     mw.progressDialog.setLabelText(text)
 
-def saveNote(nid, fld, val):
-    note = mw.col.getNote(nid)
-    note[fld] = "[sound:%s]" % val
-    note.flush()
+def saveNotes(updates):
+    fields = {}
+    for nid, fld, val in updates:
+        fields.setdefault(nid, []).append((fld, val))
+
+    for nid, values in fields.items():
+        note = mw.col.getNote(int(nid))
+        for fld, val in values:
+            note[fld] = "[sound:%s]" % val
+            # stream copied audio clips are saved with the extension of the source codec
+            note[fld.replace(" Sound", "")] = val
+        note.flush()
+
+    mw.col.autosave()
 
 def finishProgressDialog(time_diff):
     mw.progressDialog.done(0)
@@ -530,12 +749,48 @@ def finishProgressDialog(time_diff):
     message = "Processing completed in %s minutes %s seconds." % (minutes, seconds)
     QMessageBox.information(mw, "movies2anki", message)
 
+class NoteRecord(object):
+    """The fields of a note MediaWorker needs, read without loading the Note."""
+    __slots__ = ["id", "fields"]
+
+    def __init__(self, nid, fields):
+        self.id = nid
+        self.fields = fields
+
+    def __getitem__(self, key):
+        return self.fields[key]
+
+    def __contains__(self, key):
+        return key in self.fields
+
+def scanNotes(m, names, batch_size=NOTE_SCAN_BATCH_SIZE):
+    # reads the notes of a model straight from the notes table, batch_size notes at a time
+    field_map = mw.col.models.fieldMap(m)
+    names = [name for name in names if name in field_map]
+
+    last_id = 0
+    while True:
+        rows = mw.col.db.all("select id, flds from notes where mid = ? and id > ? order by id limit ?", m["id"], last_id, batch_size)
+        if len(rows) == 0:
+            break
+
+        batch = []
+        for nid, flds in rows:
+            fields = splitFields(flds)
+            batch.append(NoteRecord(nid, dict((name, fields[field_map[name][0]]) for name in names)))
+        yield batch
+
+        last_id = rows[-1][0]
+
 def update_media():
-    global ffmpeg_executable
+    global ffmpeg_executable, ffprobe_executable
 
     if not ffmpeg_executable:
         ffmpeg_executable = find_executable("ffmpeg")
 
+    if not ffprobe_executable:
+        ffprobe_executable = find_executable("ffprobe")
+
     if not ffmpeg_executable:
         return showWarning(r"""<p>Please install <a href='https://www.ffmpeg.org'>FFmpeg</a>.</p>
         On Windows download FFmpeg and either update PATH environment variable or put ffmpeg.exe in Anki installation folder (C:\Program Files\Anki).""", parent=mw)
@@ -545,6 +800,8 @@ def update_media():
         mw.progressDialog.activateWindow()
         return
     
+    media_index = media.MediaIndex(mw.col.media.dir())
+
     data = []
     for model_name in ["movies2anki (add-on)", "movies2anki - subs2srs", "movies2anki - subs2srs (video)"]:
         m = mw.col.models.byName(model_name)
@@ -552,11 +809,7 @@ def update_media():
         if m == None:
             continue
 
-        mid = m['id']
-        query = "mid:'%s'" % (mid)
-        res = mw.col.findNotes(query)
-
-        if len(res) == 0:
+        if not mw.col.db.scalar("select 1 from notes where mid = ? limit 1", m['id']):
             continue
 
         if "Audio Sound" not in mw.col.models.fieldNames(m) or ("Video Sound" not in mw.col.models.fieldNames(m) and m["name"] == "movies2anki (add-on)"):
@@ -575,16 +828,18 @@ def update_media():
             mw.progress.finish()
             mw.reset()
 
-        nids = sorted(res)
-        for nid in nids:
-            note = mw.col.getNote(nid)
+        for batch in scanNotes(m, ["Path", "Source", "Audio", "Audio Sound", "Video", "Video Sound"]):
+            for note in batch:
+                if note["Audio Sound"] == "" or not media_index.exists(note["Audio"]):
+                    data.append(note)
+                elif m["name"] == "movies2anki (add-on)" and (note["Video Sound"] == "" or not media_index.exists(note["Video"])):
+                    data.append(note)
 
-            if note["Audio Sound"] == "" or not os.path.exists(note["Audio"]):
-                data.append(note)
-            elif m["name"] == "movies2anki (add-on)" and (note["Video Sound"] == "" or not os.path.exists(note["Video"])):
-                data.append(note)
+    jobs = journal.JobJournal()
+    num_snapshots = len([filename for filename, args in jobs.pending("snapshot") if not media_index.exists(filename)])
+    jobs.close()
 
-    if len(data) == 0:
+    if len(data) == 0 and num_snapshots == 0:
         tooltip("Nothing to update")
         return
 
@@ -604,10 +859,10 @@ def update_media():
     mw.progress_bar.setAlignment(Qt.AlignCenter)
     mw.progressDialog.setBar(mw.progress_bar)
 
-    mw.worker = MediaWorker(data)
+    mw.worker = MediaWorker(data, media_index)
     mw.worker.updateProgress.connect(setProgress)
     mw.worker.updateProgressText.connect(setProgressText)
-    mw.worker.updateNote.connect(saveNote)
+    mw.worker.updateNotes.connect(saveNotes)
     mw.worker.jobFinished.connect(finishProgressDialog)
     mw.progressDialog.canceled.connect(cancelProgressDialog)
     mw.worker.start()
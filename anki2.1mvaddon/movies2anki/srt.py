@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+"""Streaming parser of SRT subtitles."""
+
+import mmap
+import os
+import re
+
+from . import timecode
+
+TIMECODE_RE = re.compile(r"^\s*(\d+):(\d+):(\d+)[,.](\d+)\s*-->\s*(\d+):(\d+):(\d+)[,.](\d+)")
+
+# files from this size are memory-mapped instead of decoded line by line
+MMAP_FILE_SIZE = 4 * 1024 * 1024
+
+# the same as TIMECODE_RE for a whole memory-mapped file, to the end of the line,
+# re.M only starts a line after \n, so lines that end with a lone \r are matched by the lookbehind
+BYTES_TIMECODE_RE = re.compile(br"(?:^|(?<=\r))(?:\xef\xbb\xbf)?[ \t]*(\d+):(\d+):(\d+)[,.](\d+)[ \t]*-->[ \t]*(\d+):(\d+):(\d+)[,.](\d+)[^\r\n]*(?:\r\n|\r|\n)?", re.M)
+BYTES_LEADING_BLANK_RE = re.compile(br"(?:\r\n|\r|\n)*")
+BYTES_BLANK_LINE_RE = re.compile(br"(?:\r\n|\r(?!\n)|\n)(?:\r\n|\r|\n)")
+BYTES_NEWLINE_RE = re.compile(br"\r\n|\r|\n")
+# one line cues that is_not_sdh_subtitle() rejects anyway: (sounds), [sounds] and ♪
+BYTES_SDH_RE = re.compile(br"[ \t]*(?:\([^)\r\n]*\)(?:[ \t]*\([^)\r\n]*\))*|[- \t]*\[[^\]\r\n]*\](?:[- \t]*\[[^\]\r\n]*\])*|(?:\xe2\x99\xaa| )+)[ \t]*")
+
+def timecode_to_seconds(hours, mins, secs, millisecs):
+    return timecode.to_seconds(timecode.from_parts(hours, mins, secs, millisecs))
+
+def iter_cues(lines):
+    """Yields (start, end, text_lines) for every cue of an iterable of lines, such as an open file.
+
+    Only one cue is kept in memory. A cue starts at its timecode line, so CRLF line
+    endings, missing blank lines between cues and stray numbering don't break it.
+    Only an empty line ends a cue, a line of spaces is part of its text.
+    """
+    start = None
+    text = []
+    for line in lines:
+        line = line.rstrip("\r\n")
+
+        m = TIMECODE_RE.match(line)
+        if m is not None:
+            if start is not None:
+                # without a blank line the number of this cue ends the previous one
+                if len(text) != 0 and text[-1].strip().isdigit():
+                    text.pop()
+                if len(text) != 0:
+                    yield start, end, text
+            start = timecode_to_seconds(*m.group(1, 2, 3, 4))
+            end = timecode_to_seconds(*m.group(5, 6, 7, 8))
+            text = []
+        elif start is None:
+            # numbering and anything else between cues
+            continue
+        elif len(line) == 0:
+            if len(text) != 0:
+                yield start, end, text
+                start = None
+                text = []
+        else:
+            text.append(line)
+
+    if start is not None and len(text) != 0:
+        yield start, end, text
+
+def iter_mapped_cues(data, skip_sdh=False):
+    """Yields the same cues as iter_cues from the bytes of a UTF-8 file, such as an mmap.
+
+    Cue boundaries and timecodes are found without decoding the file, only the text of a cue
+    is copied and decoded, and not even that for one line SDH cues when skip_sdh is set.
+    """
+    matches = BYTES_TIMECODE_RE.finditer(data)
+    m = next(matches, None)
+    while m is not None:
+        next_m = next(matches, None)
+        start = BYTES_LEADING_BLANK_RE.match(data, m.end()).end()
+        end = next_m.start() if next_m is not None else len(data)
+
+        blank = BYTES_BLANK_LINE_RE.search(data, start, end)
+        lines = BYTES_NEWLINE_RE.split(data[start:blank.start() if blank is not None else end])
+        if blank is None:
+            while len(lines) != 0 and len(lines[-1]) == 0:
+                lines.pop()
+            # without a blank line the number of the next cue ends this one
+            if next_m is not None and len(lines) != 0 and lines[-1].strip().isdigit():
+                lines.pop()
+
+        if len(lines) != 0 and not (skip_sdh and len(lines) == 1 and BYTES_SDH_RE.fullmatch(lines[0])):
+            yield (timecode_to_seconds(*m.group(1, 2, 3, 4)), timecode_to_seconds(*m.group(5, 6, 7, 8)),
+                [line.decode("utf-8") for line in lines])
+
+        m = next_m
+
+def iter_file_cues(filename, skip_sdh=False):
+    """Cues of an SRT file, files from MMAP_FILE_SIZE are memory-mapped."""
+    if os.path.getsize(filename) < MMAP_FILE_SIZE:
+        with open(filename, 'r', encoding="utf-8-sig") as f:
+            yield from iter_cues(f)
+        return
+
+    with open(filename, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield from iter_mapped_cues(data, skip_sdh)
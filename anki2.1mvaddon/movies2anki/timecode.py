@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+"""Timecodes as integer milliseconds.
+
+Subtitle times are kept in seconds, they are converted with to_ms() once and every
+timecode of a phrase is formatted from the same integer, so the timestamps in the
+filenames and the ones given to ffmpeg can't disagree by a rounding error.
+"""
+
+import math
+import re
+
+from array import array
+
+TIME_RE = re.compile(r"^\s*(\d+)[:.](\d+)[:.](\d+)[,.](\d+)\s*$")
+
+def to_ms(seconds):
+    return int(math.floor(seconds * 1000 + 0.5))
+
+def to_seconds(ms):
+    return ms / 1000.0
+
+def seconds_to_ms(values):
+    """to_ms() of every value."""
+    return array("q", [int(math.floor(t * 1000 + 0.5)) for t in values])
+
+def from_parts(hours, mins, secs, millisecs):
+    return ((int(hours) * 60 + int(mins)) * 60 + int(secs)) * 1000 + int(millisecs)
+
+def parse(text):
+    """Milliseconds of a SRT (0:01:02,500), TSV filename (0.01.02.500) or ffmpeg (0:01:02.500) timecode."""
+    m = TIME_RE.match(text)
+    if m is None:
+        raise ValueError("invalid timecode: %r" % text)
+    return from_parts(*m.groups())
+
+def parts(ms):
+    secs, millisecs = divmod(ms, 1000)
+    mins, secs = divmod(secs, 60)
+    hours, mins = divmod(mins, 60)
+    return (hours, mins, secs, millisecs)
+
+def format_srt(ms):
+    return '%02d:%02d:%02d,%03d' % parts(ms)
+
+def format_tsv(ms):
+    return '%d.%02d.%02d.%03d' % parts(ms)
+
+def format_ffmpeg(ms):
+    return '%02d:%02d:%02d.%03d' % parts(ms)
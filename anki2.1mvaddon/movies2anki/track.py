@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+"""Compact subtitle tracks: parallel arrays of times and a list of interned texts."""
+
+import sys
+
+from array import array
+
+class SubtitleTrack(object):
+    """Subtitles that behave like the list of (start, end, text) tuples they replace.
+
+    Indexing returns a tuple, item assignment, append and insert take one, so the
+    code written for lists keeps working. Stages that touch every subtitle should
+    read and change starts, ends and texts directly.
+    """
+
+    __slots__ = ["starts", "ends", "texts"]
+
+    def __init__(self, subs=()):
+        self.starts = array("d")
+        self.ends = array("d")
+        self.texts = []
+        self.extend(subs)
+
+    @classmethod
+    def from_arrays(cls, starts, ends, texts):
+        track = cls()
+        track.starts = array("d", starts)
+        track.ends = array("d", ends)
+        track.texts = [sys.intern(text) for text in texts]
+        return track
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __iter__(self):
+        return zip(self.starts, self.ends, self.texts)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return SubtitleTrack.from_arrays(self.starts[idx], self.ends[idx], self.texts[idx])
+        return (self.starts[idx], self.ends[idx], self.texts[idx])
+
+    def __setitem__(self, idx, sub):
+        self.starts[idx] = sub[0]
+        self.ends[idx] = sub[1]
+        self.texts[idx] = sys.intern(sub[2])
+
+    def __eq__(self, other):
+        if isinstance(other, SubtitleTrack):
+            return self.starts == other.starts and self.ends == other.ends and self.texts == other.texts
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "SubtitleTrack(%r)" % list(self)
+
+    def add(self, start, end, text):
+        self.starts.append(start)
+        self.ends.append(end)
+        self.texts.append(sys.intern(text))
+
+    def append(self, sub):
+        self.add(sub[0], sub[1], sub[2])
+
+    def extend(self, subs):
+        add_start, add_end, add_text = self.starts.append, self.ends.append, self.texts.append
+        for sub in subs:
+            add_start(sub[0])
+            add_end(sub[1])
+            add_text(sys.intern(sub[2]))
+
+    def insert(self, idx, sub):
+        self.starts.insert(idx, sub[0])
+        self.ends.insert(idx, sub[1])
+        self.texts.insert(idx, sys.intern(sub[2]))
+
+    def shift(self, start_delta, end_delta):
+        """Adds start_delta to every start and end_delta to every end."""
+        self.starts = array("d", [t + start_delta for t in self.starts])
+        self.ends = array("d", [t + end_delta for t in self.ends])
+
+class TrackGroups(object):
+    """A list of groups of subtitles, such as the lines of every phrase, kept in one track."""
+
+    __slots__ = ["track", "bounds"]
+
+    def __init__(self, groups=()):
+        self.track = SubtitleTrack()
+        self.bounds = array("q", [0])
+        for group in groups:
+            self.append(group)
+
+    @classmethod
+    def from_track(cls, track, bounds):
+        groups = cls()
+        groups.track = track
+        groups.bounds = bounds
+        return groups
+
+    def __len__(self):
+        return len(self.bounds) - 1
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("group index out of range")
+        return self.track[self.bounds[idx]:self.bounds[idx + 1]]
+
+    def append(self, group):
+        self.track.extend(group)
+        self.bounds.append(len(self.track))
+
+    def insert(self, idx, group):
+        group = list(group)
+        pos = self.bounds[idx]
+        for sub in reversed(group):
+            self.track.insert(pos, sub)
+        self.bounds = self.bounds[:idx + 1] + array("q", [b + len(group) for b in self.bounds[idx:]])